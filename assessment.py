@@ -1,62 +1,230 @@
+import hashlib
+import logging
+import numbers
+import os
+import time
+
+import numpy as np
 import yaml
 
 CONFIG_FILE = 'parameter_config.yml'
 
 
-with open(CONFIG_FILE, "r") as stream:
-    config = yaml.safe_load(stream)
+class RuleSet():
+    """
+    Rules of every (test, segment) compiled into padded (segments x rules) arrays.
+
+    Each rule becomes an interval test lower </<= value </<= upper, negated for
+    'not_equals', so whole arrays of values are evaluated with array comparisons and
+    the first matching rule is picked with np.select. 'equals' / 'not_equals' rules on
+    non-numeric values (e.g. strings) are kept as exact comparisons on objects.
+    Operators and their values are validated once, when the rules are compiled.
+    """
+
+    def __init__(self, config):
+        if not isinstance(config, dict) or not all(
+                isinstance(segments, dict) and all(
+                    isinstance(segment, dict) and isinstance(segment.get('rules'), list)
+                    for segment in segments.values())
+                for segments in config.values()):
+            raise ValueError("Rule config must map test -> segment -> {'rules': [...]}")
+
+        self.index = {}
+        for test_name, segments in config.items():
+            for segment in segments:
+                self.index[(test_name, segment)] = len(self.index)
+
+        n_rules = max((len(config[test_name][segment]['rules']) for test_name, segment in self.index), default=0)
+        shape = (len(self.index), n_rules)
+        self.lower = np.full(shape, -np.inf)
+        self.upper = np.full(shape, np.inf)
+        self.lower_closed = np.ones(shape, dtype=bool)
+        self.upper_closed = np.ones(shape, dtype=bool)
+        self.negate = np.zeros(shape, dtype=bool)
+        self.active = np.zeros(shape, dtype=bool)
+        self.colors = np.full(shape, None, dtype=object)
+        self.exact = np.full(shape, None, dtype=object)
+        self.is_exact = np.zeros(shape, dtype=bool)
+
+        for (test_name, segment), k in self.index.items():
+            for r, rule in enumerate(config[test_name][segment]['rules']):
+                missing = {'operator', 'value', 'color'} - set(rule)
+                if missing:
+                    raise ValueError(f"Rule {r} of '{test_name}' / '{segment}' is missing {sorted(missing)}")
+                self._compile_rule(k, r, rule['operator'], rule['value'])
+                self.active[k, r] = True
+                self.colors[k, r] = rule['color']
 
+    def _compile_rule(self, k, r, rule_operator, value):
+        if rule_operator in ('equals', 'not_equals'):
+            if isinstance(value, numbers.Real):
+                self.lower[k, r] = self.upper[k, r] = value
+            else:
+                self.exact[k, r] = value
+                self.is_exact[k, r] = True
+            self.negate[k, r] = rule_operator == 'not_equals'
+            return
+        if rule_operator != 'between' and not isinstance(value, numbers.Real):
+            raise ValueError(f"Target value {value!r} of the {rule_operator} operator must be a number")
+        if rule_operator == 'less_or_equal':
+            self.upper[k, r] = value
+        elif rule_operator == 'lower':
+            self.upper[k, r] = value
+            self.upper_closed[k, r] = False
+        elif rule_operator == 'great_or_equal':
+            self.lower[k, r] = value
+        elif rule_operator == 'higher':
+            self.lower[k, r] = value
+            self.lower_closed[k, r] = False
+        elif rule_operator == 'between':
+            if type(value) != list or len(value) != 2:
+                raise ValueError("Target value must be a list of two values for between operator")
+            if not all(isinstance(bound, numbers.Real) for bound in value):
+                raise ValueError(f"Range {value} of the between operator must hold two numbers")
+            if value[0] > value[1]:
+                raise ValueError(f"Range {value} of the between operator is empty")
+            self.lower[k, r], self.upper[k, r] = value
+        else:
+            raise ValueError(f"operator '{rule_operator}' is not supported")
+
+    def segment_ids(self, test_names, segments):
+        ids = {}
+        for pair in set(zip(test_names, segments)):
+            if pair not in self.index:
+                test_name, segment = pair
+                if not any(test == test_name for test, _ in self.index):
+                    raise ValueError(f"Test name '{test_name}' is not present in the rule config")
+                raise ValueError(f"Segment name '{segment}' is not present in the rule config for test: '{test_name}'")
+            ids[pair] = self.index[pair]
+        return np.fromiter((ids[pair] for pair in zip(test_names, segments)), dtype=np.intp, count=len(test_names))
+
+    def assess_many(self, values, test_names, segments):
+        array = np.asarray(values).ravel()
+        if array.dtype.kind in 'biuf':
+            values = array
+            numeric = array.astype(float)
+        else:
+            # Non-numeric values only match the exact rules and the negated ones
+            values = np.asarray(values, dtype=object).ravel()
+            numeric = np.fromiter((v if isinstance(v, numbers.Real) else np.nan for v in values),
+                                  dtype=float, count=len(values))
+        test_names = np.broadcast_to(np.asarray(test_names, dtype=object), values.shape)
+        segments = np.broadcast_to(np.asarray(segments, dtype=object), values.shape)
+        k = self.segment_ids(test_names, segments)
 
-class Evaluator():
-    def __init__(self) -> None:
-        pass
+        x = numeric[:, None]
+        above = np.where(self.lower_closed[k], x >= self.lower[k], x > self.lower[k])
+        below = np.where(self.upper_closed[k], x <= self.upper[k], x < self.upper[k])
+        inside = above & below
+        is_exact = self.is_exact[k]
+        if is_exact.any():
+            equal = (values.astype(object)[:, None] == self.exact[k]).astype(bool)
+            inside = np.where(is_exact, equal, inside)
+        matched = (inside ^ self.negate[k]) & self.active[k]
 
-    def equals(self, source, target):
-        return source == target
+        # First matching rule wins, None when none of the rules matched
+        return np.select(list(matched.T), list(self.colors[k].T), default=None)
 
-    def not_equals(self, source, target):
-        return source != target
 
-    def less_or_equal(self, source, target):
-        return source <= target
-    
-    def great_or_equal(self, source, target):
-        return source >= target
+class RuleConfig():
+    """
+    Rule file loaded lazily and reloaded when it changes.
 
-    def higher(self, source, target):
-        return source > target
-    
-    def lower(self, source, target):
-        return source < target
+    Every call checks the file's mtime and size; when they change the file is hashed
+    and only re-parsed, validated and compiled if its content changed. If a reload
+    fails (invalid rules, unreadable or missing file), the last valid rules are kept,
+    a warning is logged and the file is not read again until it changes.
+    `stats` counts loads and evaluations with their cumulative time in seconds.
+    """
 
-    def between(self, source, target_range):
-        if type(target_range) != list:
-            raise ValueError("Target value must be a list of two values for between operator")
-        if len(target_range) != 2:
-            raise ValueError("Target value must be a list of two values for between operator")
-        return target_range[0] <= source <= target_range[1]
+    def __init__(self, path):
+        self.path = path
+        self.config = None
+        self.rules = None
+        self._stamp = None
+        self._digest = None
+        self.stats = {'loads': 0, 'load_errors': 0, 'load_time': 0.0, 'evals': 0, 'values': 0, 'eval_time': 0.0}
 
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            # A missing file is reported once, until it shows up again
+            stamp = 'missing'
+            if stamp != self._stamp:
+                self._failed(e)
+                self._stamp = stamp
+            return self.rules
 
-def assess(value, test_name, segment):
-    if test_name not in config:
-        raise ValueError(f"Test name '{test_name}' is not present in the rule config")
+        if stamp != self._stamp:
+            try:
+                with open(self.path, "rb") as stream:
+                    raw = stream.read()
+            except OSError as e:
+                self._failed(e)
+            else:
+                digest = hashlib.sha256(raw).hexdigest()
+                if digest != self._digest:
+                    self._load(raw)
+                    self._digest = digest
+            # Also recorded after a failed load, so a bad file is read once and then skipped
+            self._stamp = stamp
+        return self.rules
 
-    if segment not in config[test_name]:
-        raise ValueError(f"Segment name '{segment}' is not present in the rule config for test: '{test_name}'")
+    def _failed(self, error):
+        self.stats['load_errors'] += 1
+        if self.rules is None:
+            raise error
+        logging.warning(f"Keeping the previous rules, reloading '{self.path}' failed: {error}")
 
-    test_config = config[test_name][segment]
-    
-    evaluator = Evaluator()
-    for rule in test_config['rules']:
+    def _load(self, raw):
+        start = time.perf_counter()
         try:
-            rule_operator = rule['operator']
-            evaluator_func = getattr(evaluator, rule['operator'])
-        except AttributeError as e:
-            raise ValueError(f"operator '{rule_operator}' is not supported")
-            
-        result = evaluator_func(value, rule['value'])
-        if result:
-            return rule.color
-    return None # none of the rules matched
-    
-assess(1, 'JEFFREYS_TEST', 'HIGH_DEFAULT_PORTFOLIO')
+            config = yaml.safe_load(raw)
+            rules = RuleSet(config)
+        except (yaml.YAMLError, ValueError, TypeError) as e:
+            self._failed(e)
+            return
+        finally:
+            self.stats['load_time'] += time.perf_counter() - start
+        self.config, self.rules = config, rules
+        self.stats['loads'] += 1
+
+    def assess_many(self, values, test_names, segments):
+        rules = self.get()
+        start = time.perf_counter()
+        colors = rules.assess_many(values, test_names, segments)
+        self.stats['evals'] += 1
+        self.stats['values'] += len(colors)
+        self.stats['eval_time'] += time.perf_counter() - start
+        return colors
+
+
+# One loader per rule file, so each process parses a file only when it changes
+_configs = {}
+
+
+def rule_config(config_file=CONFIG_FILE):
+    path = os.path.abspath(config_file)
+    if path not in _configs:
+        _configs[path] = RuleConfig(path)
+    return _configs[path]
+
+
+def assess(value, test_name, segment, config_file=CONFIG_FILE):
+    return rule_config(config_file).assess_many([value], [test_name], [segment])[0]
+
+
+def assess_many(values, test_names, segments, config_file=CONFIG_FILE):
+    """
+    RAG colours for arrays of values.
+
+    `test_names` and `segments` are arrays aligned with `values`, or single names
+    shared by all of them. Returns an object array with None where no rule matched.
+    """
+    return rule_config(config_file).assess_many(values, test_names, segments)
+
+
+if __name__ == "__main__":
+    print(assess(1, 'JEFFREYS_TEST', 'HIGH_DEFAULT_PORTFOLIO'))
@@ -1,67 +1,315 @@
+import hashlib
+import os
+import time
+from collections import deque
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from patsy import dmatrices
 from statsmodels.genmod import families
 from statsmodels.othermod.betareg import BetaModel
+import statsmodels.api as sm
 import statsmodels.formula.api as smf
 from sklearn.metrics import r2_score
 from sklearn.model_selection import train_test_split
 from statsmodels.tools.eval_measures import aic
-from itertools import combinations
+from itertools import product
 
 links = families.links
 
-np.random.seed(0)
-
-n = 1000
-Months_on_Book = np.random.normal(50, 10, n)
-utilisation_ratio = np.random.normal(0.6, 0.1, n)
-Amount = np.random.normal(500, 100, n)
-noise = np.random.uniform(-0.02, 0.02, n)
-CCF = utilisation_ratio * 0.5 + Months_on_Book * 0.002 + noise
-CCF = np.clip(CCF, 0, 1)
-
-df = pd.DataFrame({'CCF': CCF, 'utilisation_ratio': utilisation_ratio, 'Months_on_Book': Months_on_Book, 'Amount': Amount})
-
-thresholds = [0.5, 0.6]  # list of thresholds
-amount_threshold = [400]  # threshold for Amount
-model_types = ['beta', 'linear']
-model_summary = []
-
-for threshold, amount_thresh, model_type in combinations(thresholds + amount_threshold, model_types):
-    df['group'] = np.where((df['utilisation_ratio'] > threshold) & (df['Amount'] > amount_thresh), 'Group1', 'Group2')
-
-    model_summ_row = [threshold, amount_thresh, model_type]
-
-    # Models for Group 1 and Group 2
-    for group in df['group'].unique():
-        df_group = df[df['group'] == group].copy()
-        df_train, df_test = train_test_split(df_group, test_size=0.2, random_state=42)
-
-        model = "CCF ~ utilisation_ratio + Months_on_Book"
-       
-        # Check the model type
-        if model_type == 'beta':
-            mod = BetaModel.from_formula(model, df_train, link_precision=links.identity())
-        elif model_type == 'linear':
-            mod = smf.ols(formula=model, data=df_train)
-       
-        res = mod.fit()
-
-        # Add the fitted values as new columns in the original dataset and df_group
-        df.loc[df_train.index, 'fitted_values_' + str(threshold) + '_' + str(amount_thresh) + '_' + model_type] = res.fittedvalues
-        df.loc[df_test.index, 'fitted_values_' + str(threshold) + '_' + str(amount_thresh) + '_' + model_type] = res.predict(df_test)
-        df_group['fitted_values'] = df['fitted_values_' + str(threshold) + '_' + str(amount_thresh) + '_' + model_type]
-
-        # Calculate metrics
-        r2 = r2_score(df_group['CCF'], df_group['fitted_values'])
-        aic_val = aic(res.llf, df_group.shape[0], res.df_model)
-        max_pval = max(res.pvalues)
-
-        model_summ_row.extend([group, r2, aic_val, max_pval])
-
-    model_summary.append(model_summ_row)
-
-# Create a new dataframe for the model summary
-df_model_summary = pd.DataFrame(model_summary, columns=['Threshold', 'Amount_Threshold', 'Model_Type', 'Group1', 'R2_1', 'AIC_1', 'Max_pval_1', 'Group2', 'R2_2', 'AIC_2', 'Max_pval_2'])
-print(df_model_summary)
-print(df)
+SUMMARY_COLUMNS = ['Threshold', 'Amount_Threshold', 'Model_Type', 'Group1', 'R2_1', 'AIC_1', 'Max_pval_1', 'Group2', 'R2_2', 'AIC_2', 'Max_pval_2']
+
+
+def segment_groups(df, threshold, amount_thresh):
+    """Split the facilities into Group1 (high utilisation and amount) and Group2"""
+    return np.where((df['utilisation_ratio'] > threshold) & (df['Amount'] > amount_thresh), 'Group1', 'Group2')
+
+
+def _n_workers(n_jobs):
+    if n_jobs is None or n_jobs == -1:
+        return os.cpu_count() or 1
+    if isinstance(n_jobs, (int, np.integer)) and not isinstance(n_jobs, bool) and n_jobs >= 1:
+        return int(n_jobs)
+    raise ValueError(f"n_jobs must be a positive integer, or -1 / None for all cores, got {n_jobs!r}")
+
+
+# Data shared with pool workers once, instead of pickling it with every fit
+_worker_data = {}
+
+
+def _init_worker(shared):
+    _worker_data.update(shared)
+
+
+def fit_segment(rows, model_type, df=None, formula=None, target='CCF'):
+    """Fit one model on the segment at positions `rows` and return its R2, AIC and maximum p-value"""
+    if df is None:
+        df, formula, target = _worker_data['df'], _worker_data['formula'], _worker_data['target']
+
+    df_group = df.iloc[rows]
+    df_train, df_test = train_test_split(df_group, test_size=0.2, random_state=42)
+
+    # Check the model type
+    if model_type == 'beta':
+        # Same boundary handling as `fit_beta`: exact 0 or 1 values are squeezed into (0, 1)
+        y_train = df_train[target].to_numpy(dtype=float)
+        if ((y_train <= 0) | (y_train >= 1)).any():
+            df_train = df_train.assign(**{target: boundary_transform(y_train)})
+        mod = BetaModel.from_formula(formula, df_train, link_precision=links.identity())
+    elif model_type == 'linear':
+        mod = smf.ols(formula=formula, data=df_train)
+    else:
+        raise ValueError(f"Model type '{model_type}' is not supported")
+
+    res = mod.fit()
+
+    # Fitted values on the training rows and predictions on the test rows
+    fitted_values = pd.concat([res.fittedvalues, res.predict(df_test)]).reindex(df_group.index)
+
+    # Calculate metrics
+    r2 = r2_score(df_group[target], fitted_values)
+    aic_val = aic(res.llf, df_group.shape[0], res.df_model)
+    max_pval = max(res.pvalues)
+
+    return r2, aic_val, max_pval
+
+
+def design_matrices(df, formula):
+    """Build the response vector and design matrix once for the full frame"""
+    y, X = dmatrices(formula, df, NA_action='raise')
+    return np.asarray(y)[:, 0], np.asarray(X)
+
+
+def boundary_transform(y):
+    """Squeeze values in [0, 1] into (0, 1) with (y * (n - 1) + 0.5) / n (Smithson and Verkuilen, 2006)"""
+    n = len(y)
+    return (y * (n - 1) + 0.5) / n
+
+
+def fit_beta(y, X, start_params=None, adjust_boundary=True, maxiter=1000):
+    """
+    Fit a beta regression with constant precision directly on arrays.
+
+    Parameters
+    ----------
+    y : array of shape (n,)
+        Response in [0, 1].
+    X : array of shape (n, p)
+        Design matrix, including the intercept column.
+    start_params : array of shape (p + 1,), optional
+        Starting values, e.g. the parameters of a neighbouring segment.
+        The default lets statsmodels start from an OLS fit on the logit scale.
+    adjust_boundary : bool
+        Apply `boundary_transform` when `y` contains exact 0 or 1 values,
+        which the beta likelihood cannot handle.
+    """
+    y = np.asarray(y, dtype=float)
+    if adjust_boundary and ((y <= 0) | (y >= 1)).any():
+        y = boundary_transform(y)
+    mod = BetaModel(y, X, link_precision=links.identity())
+    return mod.fit(start_params=start_params, maxiter=maxiter)
+
+
+def design_key(X):
+    """Identify a design matrix by its column count and a hash of its values"""
+    X = np.ascontiguousarray(X)
+    return X.shape[1], hashlib.sha1(X.tobytes()).hexdigest()
+
+
+def nearest_start_params(warm_starts, design, membership):
+    """
+    Return the parameters of the fit in `warm_starts` on the same design whose training set
+    differs from `membership` in the fewest rows.
+
+    `warm_starts` holds (design, packed training membership, parameters) entries; fits on
+    another design or another number of rows are never used as starting values.
+    """
+    best, best_distance = None, None
+    for fit_design, packed, params in warm_starts:
+        if fit_design != design or packed.shape != membership.shape:
+            continue
+        distance = np.unpackbits(packed ^ membership).sum()
+        if best_distance is None or distance < best_distance:
+            best, best_distance = params, distance
+    return best
+
+
+def fit_segment_matrix(rows, model_type, y=None, X=None, warm_starts=None, design=None):
+    """
+    Same as `fit_segment`, but slices prebuilt arrays instead of re-parsing the formula.
+
+    Beta fits warm-start from the nearest segment already registered in `warm_starts`
+    (a deque of fits, created once per grid search), and register themselves there.
+    `design` is the `design_key` of X, computed here when not given.
+    """
+    if y is None:
+        y, X = _worker_data['y'], _worker_data['X']
+        warm_starts, design = _worker_data['warm_starts'], _worker_data['design']
+
+    train, test = train_test_split(rows, test_size=0.2, random_state=42)
+
+    if model_type == 'beta':
+        start_params = None
+        if warm_starts is not None:
+            if design is None:
+                design = design_key(X)
+            membership = np.zeros(len(y), dtype=bool)
+            membership[train] = True
+            membership = np.packbits(membership)
+            start_params = nearest_start_params(warm_starts, design, membership)
+        res = fit_beta(y[train], X[train], start_params=start_params)
+        if warm_starts is not None:
+            warm_starts.append((design, membership, res.params))
+        predicted = res.model.predict(res.params, exog=X[test])
+    elif model_type == 'linear':
+        res = sm.OLS(y[train], X[train]).fit()
+        predicted = X[test] @ res.params
+    else:
+        raise ValueError(f"Model type '{model_type}' is not supported")
+
+    r2 = r2_score(np.concatenate([y[train], y[test]]), np.concatenate([res.fittedvalues, predicted]))
+    aic_val = aic(res.llf, len(rows), res.df_model)
+    max_pval = max(res.pvalues)
+
+    return r2, aic_val, max_pval
+
+
+def iter_grid_search(df, formula, thresholds, amount_thresholds, model_types, target='CCF', n_jobs=1, engine='matrix'):
+    """
+    Fit every (segmentation, model type) combination and yield one summary row per combination.
+
+    Segments with identical membership are fitted only once per model type, fits run in a
+    process pool when n_jobs > 1, and rows are yielded as soon as both groups of a
+    combination are fitted. Nothing is written to `df`.
+
+    With engine='matrix' the design matrix is built once and beta fits are warm-started
+    (`fit_segment_matrix`); engine='formula' refits each segment from the formula (`fit_segment`).
+    """
+    if engine == 'matrix':
+        y, X = design_matrices(df, formula)
+        # Each run (and each of its pool workers) starts with its own warm-start store
+        fit, shared = fit_segment_matrix, dict(y=y, X=X, warm_starts=deque(maxlen=64), design=design_key(X))
+    elif engine == 'formula':
+        fit, shared = fit_segment, dict(df=df, formula=formula, target=target)
+    else:
+        raise ValueError(f"Engine '{engine}' is not supported")
+
+    combos = []
+    segments = {}  # (membership hash, model type) -> row positions
+    for threshold, amount_thresh, model_type in product(thresholds, amount_thresholds, model_types):
+        groups = segment_groups(df, threshold, amount_thresh)
+        keys = []
+        for group in pd.unique(groups):
+            membership = groups == group
+            key = (hashlib.sha1(np.packbits(membership).tobytes()).hexdigest(), model_type)
+            segments.setdefault(key, np.flatnonzero(membership))
+            keys.append((group, key))
+        combos.append(([threshold, amount_thresh, model_type], keys))
+
+    def summary_row(combo, fits):
+        row, keys = combo
+        row = list(row)
+        for group, key in keys:
+            row.extend([group, *fits[key]])
+        return row + [None] * (len(SUMMARY_COLUMNS) - len(row))
+
+    max_workers = _n_workers(n_jobs)
+
+    if max_workers == 1:
+        fits = {}
+        for combo in combos:
+            for _, key in combo[1]:
+                if key not in fits:
+                    fits[key] = fit(segments[key], key[1], **shared)
+            yield summary_row(combo, fits)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(shared,)) as pool:
+        futures = {pool.submit(fit, rows, key[1]): key for key, rows in segments.items()}
+        fits = {}
+        pending = list(combos)
+        for future in as_completed(futures):
+            fits[futures[future]] = future.result()
+            ready = [combo for combo in pending if all(key in fits for _, key in combo[1])]
+            for combo in ready:
+                pending.remove(combo)
+                yield summary_row(combo, fits)
+
+
+def grid_search(df, formula, thresholds, amount_thresholds, model_types, target='CCF', n_jobs=1, engine='matrix'):
+    """
+    Collect the grid search rows into a summary table, in the order of the parameter grid
+    (itertools.product of the thresholds, amount thresholds and model types as given),
+    whatever order the parallel fits complete in.
+    """
+    thresholds, amount_thresholds, model_types = list(thresholds), list(amount_thresholds), list(model_types)
+    grid = list(product(thresholds, amount_thresholds, model_types))
+    position = {combo: i for i, combo in reversed(list(enumerate(grid)))}
+    rows = list(iter_grid_search(df, formula, thresholds, amount_thresholds, model_types, target, n_jobs, engine))
+    rows.sort(key=lambda row: position[tuple(row[:3])])
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def benchmark_beta_fit(n=1_000_000, thresholds=(0.5, 0.55, 0.6), seed=0):
+    """
+    Time formula-based, cold matrix and warm-started matrix beta fits on `n` simulated facilities.
+
+    The simulated CCFs include exact 0 and 1 values, so every fit goes through `boundary_transform`.
+    Returns one row of timings (in seconds) per utilisation threshold.
+    """
+    rng = np.random.default_rng(seed)
+    Months_on_Book = rng.normal(50, 10, n)
+    utilisation_ratio = rng.normal(0.6, 0.1, n)
+    CCF = np.clip(utilisation_ratio * 0.5 + Months_on_Book * 0.002 + rng.normal(0, 0.1, n), 0, 1)
+    df = pd.DataFrame({'CCF': CCF, 'utilisation_ratio': utilisation_ratio, 'Months_on_Book': Months_on_Book})
+    formula = "CCF ~ utilisation_ratio + Months_on_Book"
+
+    y, X = design_matrices(df, formula)
+    previous = None
+    timings = []
+    for threshold in thresholds:
+        rows = np.flatnonzero(utilisation_ratio > threshold)
+
+        start = time.perf_counter()
+        df_group = df.iloc[rows].assign(CCF=boundary_transform(CCF[rows]))
+        BetaModel.from_formula(formula, df_group, link_precision=links.identity()).fit()
+        formula_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fit_beta(y[rows], X[rows])
+        matrix_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        res = fit_beta(y[rows], X[rows], start_params=previous)
+        warm_time = time.perf_counter() - start
+        previous = res.params
+
+        timings.append([threshold, len(rows), formula_time, matrix_time, warm_time])
+
+    return pd.DataFrame(timings, columns=['Threshold', 'Facilities', 'Formula_s', 'Matrix_s', 'Warm_start_s'])
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+
+    n = 1000
+    Months_on_Book = np.random.normal(50, 10, n)
+    utilisation_ratio = np.random.normal(0.6, 0.1, n)
+    Amount = np.random.normal(500, 100, n)
+    noise = np.random.uniform(-0.02, 0.02, n)
+    CCF = utilisation_ratio * 0.5 + Months_on_Book * 0.002 + noise
+    CCF = np.clip(CCF, 0, 1)
+
+    df = pd.DataFrame({'CCF': CCF, 'utilisation_ratio': utilisation_ratio, 'Months_on_Book': Months_on_Book, 'Amount': Amount})
+
+    thresholds = [0.5, 0.6]  # list of thresholds
+    amount_threshold = [400]  # threshold for Amount
+    model_types = ['beta', 'linear']
+
+    model = "CCF ~ utilisation_ratio + Months_on_Book"
+
+    # Create a new dataframe for the model summary
+    df_model_summary = grid_search(df, model, thresholds, amount_threshold, model_types, n_jobs=2)
+    print(df_model_summary)
+    print(df)
@@ -1,24 +1,224 @@
+import hashlib
+import warnings
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
-from scipy.cluster.hierarchy import dendrogram, linkage, fcluster
+from scipy.cluster.hierarchy import dendrogram, linkage, fcluster, cut_tree
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial.distance import squareform
 from sklearn.metrics import silhouette_score
-from scipy.stats import pearsonr, spearmanr
+from scipy.stats import pearsonr, spearmanr, rankdata
+
+# Class to rank each DataFrame once and reuse the float32 ranks for Spearman correlations
+class RankCache:
+    # Ranks are computed per column (average ties, NaNs kept), so Pearson on the cached
+    # ranks equals df.corr(method='spearman') for complete data; with missing values,
+    # correlation() falls back to df.corr. Entries are keyed by a hash of the frame's
+    # index, columns and values, so an edited frame is ranked again and no frame is
+    # kept alive; the `maxsize` most recently used entries are kept.
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._ranks = OrderedDict()
+
+    @staticmethod
+    def _key(df):
+        digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()).hexdigest()
+        return df.shape, tuple(df.columns), digest
+
+    def ranks(self, df):
+        key = self._key(df)
+        if key in self._ranks:
+            self._ranks.move_to_end(key)
+        else:
+            self._ranks[key] = df.rank().astype(np.float32)
+            while len(self._ranks) > self.maxsize:
+                self._ranks.popitem(last=False)
+        return self._ranks[key]
+
+    def correlation(self, df):
+        ranks = self.ranks(df)
+        if ranks.isna().to_numpy().any():
+            # Each pair must be ranked over the rows both columns observe, as df.corr does
+            return df.corr(method='spearman')
+        # Complete data: one float32 matrix product instead of pairwise-complete loops
+        centered = ranks.to_numpy() - ranks.to_numpy().mean(axis=0)
+        cov = centered.T @ centered
+        std = np.sqrt(np.diag(cov))
+        return pd.DataFrame(cov / np.outer(std, std), index=df.columns, columns=df.columns)
+
+    def clear(self):
+        self._ranks.clear()
 
 # Function to calculate distance based on correlation
-def correlation_distance(df, method='pearson'):
+def correlation_distance(df, method='pearson', rank_cache=None):
     if method == 'pearson':
         corr = df.corr(method='pearson')
+    elif method == 'spearman' and rank_cache is not None:
+        corr = rank_cache.correlation(df)
     elif method == 'spearman':
         corr = df.corr(method='spearman')
     # Convert correlation to distance
     dist = 1 - corr
     return dist
 
+# Function to compute Spearman correlations over a rolling window, updating ranks incrementally
+def rolling_spearman(df, window, step=1):
+    # Yields (last index label of the window, float32 correlation matrix). When the window
+    # moves, values above the leaving observation drop one rank and values above the
+    # entering one gain one (half a rank for ties), so no column is re-ranked.
+    values = df.to_numpy(dtype=np.float64)
+    window_values = values[:window].copy()
+    ranks = rankdata(window_values, axis=0).astype(np.float32)
+    oldest = 0
+
+    def rank_correlation():
+        centered = ranks - ranks.mean(axis=0)
+        cov = centered.T @ centered
+        std = np.sqrt(np.diag(cov))
+        return cov / np.outer(std, std)
+
+    yield df.index[window - 1], rank_correlation()
+    for t in range(window, len(values)):
+        leaving, entering = window_values[oldest], values[t]
+        ranks -= (window_values > leaving) + np.float32(0.5) * (window_values == leaving)
+        window_values[oldest] = entering
+        greater, equal = window_values > entering, window_values == entering
+        ranks += greater + np.float32(0.5) * equal
+        ranks[oldest] = (window_values < entering).sum(axis=0) + (equal.sum(axis=0) + 1) / 2
+        oldest = (oldest + 1) % window
+        if (t - window + 1) % step == 0:
+            yield df.index[t], rank_correlation()
+
+# Function to calculate the pairwise-complete correlations of data with missing values in row blocks
+def _masked_correlation(values, observed, block_size, dtype):
+    # Per pair of columns, the counts, sums, sums of squares and cross-products over the
+    # rows where both are observed, so each pair uses its own means as in pandas
+    x = np.where(observed, values - np.nanmean(values, axis=0), 0)
+    n_cols = values.shape[1]
+    count, sums, squares, cross = (np.zeros((n_cols, n_cols)) for _ in range(4))
+    for start in range(0, len(values), block_size):
+        block = x[start:start + block_size].astype(dtype)
+        mask = observed[start:start + block_size].astype(dtype)
+        count += mask.T @ mask
+        sums += block.T @ mask
+        squares += (block * block).T @ mask
+        cross += block.T @ block
+    return _pairwise_correlation(count, sums, squares, cross).astype(dtype)
+
+def _pairwise_correlation(count, sums, squares, cross):
+    # Correlations from the pairwise counts and (shifted) sums of _masked_correlation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (count * cross - sums * sums.T) / np.sqrt((count * squares - sums**2) * (count * squares.T - sums.T**2))
+    corr[count < 2] = np.nan
+    diagonal = np.diag(corr).copy()
+    np.fill_diagonal(corr, np.where(np.isnan(diagonal), np.nan, 1))
+    return np.clip(corr, -1, 1)
+
+# Function to calculate the correlation matrix in float32 row blocks
+def blocked_correlation(df, method='pearson', block_size=10000, dtype=np.float32):
+    # Missing values are handled pairwise as in df.corr. For Spearman, each column is then
+    # ranked over its own observations instead of over the rows shared with every other
+    # column, which only approximates the pairwise-complete Spearman correlation.
+    values = df.to_numpy(dtype=np.float64)
+    observed = ~np.isnan(values)
+    if not observed.all():
+        if method == 'spearman':
+            warnings.warn("Data has missing values: Spearman correlations use per-column ranks and differ "
+                          "from the pairwise-complete ones of df.corr.", RuntimeWarning)
+            values = df.rank().to_numpy(dtype=np.float64)
+        return _masked_correlation(values, observed, block_size, dtype)
+    if method == 'spearman':
+        values = rankdata(values, axis=0)
+    # Standardise with float64 moments, accumulate the cross-products in float32 blocks
+    mean = values.mean(axis=0)
+    std = values.std(axis=0, ddof=1)
+    corr = np.zeros((values.shape[1], values.shape[1]), dtype=dtype)
+    for start in range(0, len(values), block_size):
+        block = ((values[start:start + block_size] - mean) / std).astype(dtype)
+        corr += block.T @ block
+    corr /= len(values) - 1
+    np.fill_diagonal(corr, 1)
+    return corr
+
+# Function to approximate the correlation matrix from a randomized low-rank sketch
+def sketched_correlation(df, method='pearson', rank=100, n_oversamples=10, n_iter=2, seed=0, dtype=np.float32):
+    values = df.to_numpy(dtype=np.float64)
+    if method == 'spearman':
+        values = rankdata(values, axis=0)
+    z = ((values - values.mean(axis=0)) / values.std(axis=0, ddof=1)).astype(dtype)
+    # Randomized range finder for Z'Z, with a few power iterations
+    rng = np.random.default_rng(seed)
+    basis = z.T @ (z @ rng.standard_normal((z.shape[1], rank + n_oversamples)).astype(dtype))
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(basis)
+        basis = z.T @ (z @ basis)
+    basis, _ = np.linalg.qr(basis)
+    projected = z @ basis
+    corr = basis @ (projected.T @ projected) @ basis.T / (len(z) - 1)
+    # Rescale to a unit diagonal
+    scale = np.sqrt(np.diag(corr))
+    corr /= np.outer(scale, scale)
+    np.fill_diagonal(corr, 1)
+    return corr
+
+# Function to compute silhouette scores for several cuts of one linkage in a single pass
+def silhouette_scores(dist, labels):
+    # One-hot cluster memberships of all cuts side by side, so one product gives every
+    # point's distance sum to every cluster of every cut
+    n_clusters = labels.max(axis=0) + 1
+    offsets = np.concatenate([[0], np.cumsum(n_clusters)])
+    membership = np.zeros((len(labels), offsets[-1]), dtype=dist.dtype)
+    for j in range(labels.shape[1]):
+        membership[np.arange(len(labels)), offsets[j] + labels[:, j]] = 1
+    distance_sums = dist @ membership
+
+    points = np.arange(len(labels))
+    scores = []
+    for j in range(labels.shape[1]):
+        own = labels[:, j]
+        sums = distance_sums[:, offsets[j]:offsets[j + 1]]
+        sizes = membership[:, offsets[j]:offsets[j + 1]].sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = sums[points, own] / (sizes[own] - 1)
+            mean_dist = sums / sizes
+            mean_dist[points, own] = np.inf
+            b = mean_dist.min(axis=1)
+            s = np.nan_to_num((b - a) / np.maximum(a, b))
+        s[sizes[own] == 1] = 0
+        scores.append(s.mean())
+    return np.array(scores)
+
+# Function for average-linkage clustering of a correlation matrix, scoring all k in one pass
+def cluster_correlation(corr, columns, k=None, max_k=10):
+    dist = 1 - np.asarray(corr)
+    np.fill_diagonal(dist, 0)
+    Z = linkage(squareform(dist, checks=False), 'average')
+    if k is None:
+        range_n_clusters = np.arange(2, min(len(columns) - 1, max_k) + 1)
+        labels = cut_tree(Z, n_clusters=range_n_clusters)
+        k = range_n_clusters[np.argmax(silhouette_scores(dist, labels))]
+    clusters = fcluster(Z, k, criterion='maxclust')
+    return pd.DataFrame({'Risk Factor': columns, 'Cluster': clusters})
+
 # Function for hierarchical clustering and determining the number of clusters
-def hierarchical_clustering(df, metric='raw pearson', k=None):
+def hierarchical_clustering(df, metric='raw pearson', k=None, mode='exact', max_k=10, sketch_rank=None, rank_cache=None):
+    # mode='exact' uses the full pandas correlation and scikit-learn silhouettes.
+    # mode='fast' computes the correlation in float32 blocks (or from a low-rank sketch
+    # if sketch_rank is given), cuts the linkage at all k at once and scores every
+    # cut from shared distance sums.
+    if mode == 'fast':
+        method = metric.split()[1]
+        if sketch_rank is None:
+            corr = blocked_correlation(df, method)
+        else:
+            corr = sketched_correlation(df, method, rank=sketch_rank)
+        return cluster_correlation(corr, df.columns, k, max_k)
+    elif mode != 'exact':
+        raise ValueError(f"Mode '{mode}' is not supported. Please choose from ['exact', 'fast']")
+
     # Calculate distance matrix
-    dist = correlation_distance(df, metric.split()[1])
+    dist = correlation_distance(df, metric.split()[1], rank_cache)
     # Convert to condensed distance matrix for linkage method
     condensed_dist = squareform(dist, checks=False)
     # Perform hierarchical clustering
@@ -27,7 +227,7 @@ def hierarchical_clustering(df, metric='raw pearson', k=None):
     # Determine the optimal number of clusters if not specified
     if k is None:
         # Use silhouette score to find the optimal number of clusters, k
-        range_n_clusters = list(range(2, min(len(df.columns), 10) + 1))
+        range_n_clusters = list(range(2, min(len(df.columns) - 1, max_k) + 1))
         best_score = -1
         for n_clusters in range_n_clusters:
             labels = fcluster(Z, n_clusters, criterion='maxclust')
@@ -44,6 +244,84 @@ def hierarchical_clustering(df, metric='raw pearson', k=None):
     
     return cluster_df
 
+# Class to maintain correlation clusters as new observations arrive
+class IncrementalCorrelationClustering:
+    """
+    Correlation clusters of risk factors, updated from running sums instead of the full history.
+
+    Per pair of factors, the running count, sums, sums of squares and cross-products over
+    the rows where both are observed give the pairwise-complete correlation matrix (as
+    df.corr) after each update in O(new rows x factors^2). Factors are
+    re-clustered only when some correlation has moved by more than `threshold` since the
+    last clustering. Cluster labels are matched to the previous ones by maximum overlap,
+    so that the factors which changed cluster can be reported.
+    """
+
+    def __init__(self, threshold=0.05, k=None, max_k=10):
+        self.threshold = threshold
+        self.k = k
+        self.max_k = max_k
+        self.columns = None
+        self.n = 0
+        self.clusters = None
+        self.reclustered = False
+        self._reference_corr = None
+
+    def update(self, new_df):
+        if self.columns is None:
+            self.columns = list(new_df.columns)
+            # Sums are kept around the first batch's means for numerical stability
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                self._shift = np.nan_to_num(np.nanmean(new_df.to_numpy(dtype=np.float64), axis=0))
+            n_cols = len(self.columns)
+            self._count, self._sums, self._squares, self._cross = (np.zeros((n_cols, n_cols)) for _ in range(4))
+
+        x = new_df[self.columns].to_numpy(dtype=np.float64) - self._shift
+        observed = ~np.isnan(x)
+        x = np.where(observed, x, 0)
+        mask = observed.astype(np.float64)
+        self.n += len(x)
+        self._count += mask.T @ mask
+        self._sums += x.T @ mask
+        self._squares += (x * x).T @ mask
+        self._cross += x.T @ x
+
+        corr = self.correlation()
+        drift = np.inf if self._reference_corr is None else np.max(np.abs(corr - self._reference_corr))
+        self.reclustered = drift > self.threshold
+        if self.reclustered:
+            clusters = cluster_correlation(corr, self.columns, self.k, self.max_k)
+            self.clusters = self._match_previous(clusters)
+            self._reference_corr = corr
+        else:
+            self.clusters = self.clusters.assign(**{'Previous Cluster': self.clusters['Cluster'], 'Changed': False})
+        return self.clusters
+
+    def correlation(self):
+        return _pairwise_correlation(self._count, self._sums, self._squares, self._cross)
+
+    def changed_factors(self):
+        return self.clusters.loc[self.clusters['Changed'], 'Risk Factor'].tolist()
+
+    def _match_previous(self, clusters):
+        if self.clusters is None:
+            return clusters.assign(**{'Previous Cluster': np.nan, 'Changed': False})
+        previous = self.clusters['Cluster'].to_numpy()
+        current = clusters['Cluster'].to_numpy()
+        # Relabel the new clusters after the old ones they overlap most with
+        overlap = pd.crosstab(current, previous)
+        rows, cols = linear_sum_assignment(-overlap.to_numpy())
+        mapping = dict(zip(overlap.index[rows], overlap.columns[cols]))
+        next_label = max(previous.max(), current.max()) + 1
+        for label in overlap.index:
+            if label not in mapping:
+                mapping[label] = next_label
+                next_label += 1
+        relabelled = np.array([mapping[label] for label in current])
+        return pd.DataFrame({'Risk Factor': clusters['Risk Factor'], 'Cluster': relabelled,
+                             'Previous Cluster': previous, 'Changed': relabelled != previous})
+
 # Dummy data
 np.random.seed(42)  # For reproducible results
 data = np.random.rand(100, 5)  # 100 observations of 5 risk factors
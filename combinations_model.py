@@ -1,34 +1,163 @@
 import itertools
+from math import comb
 
-# number of items in each list
-x = 5
-y = 5
-z = 5
-
-# maximum number of items in each combination
-n = 2
-
-# dynamically create lists
-list_x = ['x' + str(i + 1) for i in range(x)]
-list_y = ['y' + str(i + 1) for i in range(y)]
-list_z = ['z' + str(i + 1) for i in range(z)]
-
-# generate all combinations of up to n items for each list
-combos_x = [list(itertools.combinations(list_x, i + 1)) for i in range(n)]
-combos_y = [list(itertools.combinations(list_y, i + 1)) for i in range(n)]
-combos_z = [list(itertools.combinations(list_z, i + 1)) for i in range(n)]
-
-# flatten the lists of combinations
-combos_x = [item for sublist in combos_x for item in sublist]
-combos_y = [item for sublist in combos_y for item in sublist]
-combos_z = [item for sublist in combos_z for item in sublist]
-
-# combine the combinations from the three lists
-all_combos = list(itertools.product(combos_x, combos_y, combos_z))
-
-# print the number of combinations and the combinations themselves
-print(f'There are {len(all_combos)} combinations:')
-for combo in all_combos:
-    # combine tuples from each list into one tuple
-    flattened_combo = tuple(itertools.chain.from_iterable(combo))
-    print(flattened_combo)
+import numpy as np
+
+
+class CombinationSpace:
+    """
+    Lazy enumeration of predictor combinations built from groups of candidates.
+
+    Each combination takes between `min_per_group` and `per_group` items from every group
+    and at most `max_pred` items in total; combinations containing a forbidden pair are
+    pruned while enumerating, together with every combination that extends them.
+
+    Combinations are numbered in a fixed raw order (by the groups they draw from in turn,
+    smaller subsets first, then the order of itertools.combinations) before pruning, so
+    `iter(start, stop)` lets workers each take a slice of the raw index range without
+    building the whole list.
+    Pruned combinations keep their raw index, so shards of equal raw size may yield
+    different numbers of combinations.
+
+    Parameters
+    ----------
+    groups : dict or list
+        Candidate names per group, e.g. {'gdp': ['gdp', 'gdp_lag1'], ...} or [['x1', 'x2'], ...].
+    max_pred : int, optional
+        Maximum number of items per combination. Defaults to no limit.
+    per_group : int
+        Maximum number of items taken from one group.
+    min_per_group : int
+        Minimum number of items taken from every group. With 0, groups may be left out
+        (the empty combination is never yielded).
+    forbidden_pairs : iterable of pairs
+        Pairs of names that may not appear in the same combination,
+        e.g. the output of `forbidden_pairs_from_corr`.
+    """
+
+    def __init__(self, groups, max_pred=None, per_group=1, min_per_group=0, forbidden_pairs=()):
+        groups = list(groups.values()) if isinstance(groups, dict) else list(groups)
+        self.names = [name for group in groups for name in group]
+        ids = {name: i for i, name in enumerate(self.names)}
+        offsets = np.cumsum([0] + [len(group) for group in groups])
+        self.groups = [list(range(offsets[g], offsets[g + 1])) for g in range(len(groups))]
+
+        self.per_group = per_group
+        self.min_per_group = min_per_group
+        max_total = sum(min(per_group, len(group)) for group in self.groups)
+        self.max_pred = max_total if max_pred is None else min(max_pred, max_total)
+
+        # Forbidden partners of each candidate, as bitmasks over candidate ids
+        self._forbidden = [0] * len(self.names)
+        for a, b in forbidden_pairs:
+            if a in ids and b in ids:
+                self._forbidden[ids[a]] |= 1 << ids[b]
+                self._forbidden[ids[b]] |= 1 << ids[a]
+
+        # _counts[g][r]: number of raw completions once groups before g are decided, using at most r items
+        self._counts = [[1] * (self.max_pred + 1) for _ in range(len(self.groups) + 1)]
+        for g in range(len(self.groups) - 1, -1, -1):
+            for r in range(self.max_pred + 1):
+                take = sum(comb(len(self.groups[g]), s) * self._counts[g + 1][r - s] for s in self._sizes(g, r))
+                # With optional groups the completions of g + 1 (which skip g) are also completions of g
+                self._counts[g][r] = take + (self._counts[g + 1][r] if min_per_group == 0 else 0)
+
+    def _sizes(self, g, budget):
+        return range(max(1, self.min_per_group), min(self.per_group, len(self.groups[g]), budget) + 1)
+
+    def __len__(self):
+        """Size of the raw index range, before pruning forbidden pairs"""
+        return self._counts[0][self.max_pred]
+
+    def __iter__(self):
+        return self.iter()
+
+    def shards(self, n_shards):
+        """Split the raw index range into `n_shards` contiguous (start, stop) slices"""
+        total = len(self)
+        return [(i * total // n_shards, (i + 1) * total // n_shards) for i in range(n_shards)]
+
+    def iter(self, start=0, stop=None):
+        """Yield the valid combinations whose raw index lies in [start, stop), as tuples of names"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start < stop:
+            yield from self._walk(0, self.max_pred, 0, start, stop, 0, ())
+
+    def _walk(self, g, budget, offset, start, stop, chosen_mask, chosen):
+        # Stop here, leaving the remaining groups empty; with mandatory groups only once all are used
+        if self.min_per_group == 0 or g == len(self.groups):
+            if offset >= stop:
+                return
+            if offset >= start and chosen:
+                yield tuple(self.names[i] for i in chosen)
+            offset += 1
+
+        # Otherwise take the next items from group h: any later group if groups are optional, else g itself
+        next_groups = range(g, len(self.groups)) if self.min_per_group == 0 else range(g, min(g + 1, len(self.groups)))
+        for h in next_groups:
+            members = self.groups[h]
+            for s in self._sizes(h, budget):
+                sub = self._counts[h + 1][budget - s]
+                block = comb(len(members), s) * sub
+                if block == 0:
+                    continue
+                # Skip whole blocks of subsets before the requested range
+                if offset + block <= start:
+                    offset += block
+                    continue
+                if offset >= stop:
+                    return
+
+                first = max(0, start - offset) // sub
+                offset += first * sub
+                for subset in itertools.islice(itertools.combinations(members, s), first, None):
+                    if offset >= stop:
+                        return
+                    mask = chosen_mask
+                    for i in subset:
+                        if self._forbidden[i] & mask:
+                            break
+                        mask |= 1 << i
+                    else:
+                        yield from self._walk(h + 1, budget - s, offset, start, stop, mask, chosen + subset)
+                    offset += sub
+
+
+def forbidden_pairs_from_corr(corr, threshold=0.8):
+    """
+    Return the pairs of variables whose absolute correlation exceeds `threshold`.
+
+    Parameters
+    ----------
+    corr : DataFrame
+        Correlation matrix, e.g. df.corr().
+    threshold : float
+        Absolute correlation above which two variables may not enter the same model.
+    """
+    values = np.abs(corr.to_numpy())
+    rows, cols = np.nonzero(np.triu(values > threshold, k=1))
+    columns = corr.columns
+    return [(columns[i], columns[j]) for i, j in zip(rows, cols)]
+
+
+if __name__ == "__main__":
+    # number of items in each list
+    x = 5
+    y = 5
+    z = 5
+
+    # maximum number of items in each combination
+    n = 2
+
+    # dynamically create lists
+    list_x = ['x' + str(i + 1) for i in range(x)]
+    list_y = ['y' + str(i + 1) for i in range(y)]
+    list_z = ['z' + str(i + 1) for i in range(z)]
+
+    # combinations of 1 to n items from each list, enumerated lazily
+    all_combos = CombinationSpace([list_x, list_y, list_z], per_group=n, min_per_group=1)
+
+    # print the number of combinations and the combinations themselves
+    print(f'There are {len(all_combos)} combinations:')
+    for combo in all_combos:
+        print(combo)
@@ -5,8 +5,13 @@ import seaborn as sns
 from statsmodels.formula.api import ols
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import statsmodels.api as sm
-from patsy import dmatrix, dmatrices
+from patsy import dmatrix, dmatrices, ModelDesc, NAAction
+import os
+import sys
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import NamedTuple
 warnings.filterwarnings('ignore')
 
 # Set seed for reproducibility
@@ -54,10 +59,187 @@ def generate_time_series_data(n_samples=500):
     df = df.set_index('date')
     return df
 
+class Fold(NamedTuple):
+    """Row positions of one CV fold as half-open ``(start, stop)`` ranges."""
+    train: tuple  # one or more (start, stop) ranges
+    test: tuple   # a single (start, stop) range
+
+
+FOLD_SCHEMES = ('expanding', 'sliding', 'blocked', 'walk_forward')
+
+
+def make_folds(n, scheme='expanding', n_splits=5, min_train_size=0.5, test_size=0.2,
+               gap=0, window_size=None, refit_every=1):
+    """
+    Build train/test row ranges for time series cross-validation.
+    
+    Parameters:
+    -----------
+    n : int
+        Number of observations
+    scheme : str
+        'expanding' - training window grows from the start of the series
+        'sliding' - training window of fixed length moves forward
+        'blocked' - series cut into n_splits contiguous test blocks, training on
+                    the remaining blocks with `gap` rows purged on both sides
+        'walk_forward' - consecutive test blocks until the end of the series,
+                         refitting every `refit_every` blocks (n_splits is ignored)
+    n_splits : int
+        Number of validation splits
+    min_train_size : float
+        Minimum fraction of data to use for initial training
+    test_size : float
+        Fraction of data to use for each test set
+    gap : int
+        Number of rows left out between training and test data
+    window_size : float, optional
+        Fraction of data in the sliding training window. Defaults to
+        min_train_size for 'sliding'; makes 'walk_forward' slide instead of expand.
+    refit_every : int
+        Number of walk-forward test blocks that share one fitted model
+    
+    Returns:
+    --------
+    list of Fold
+    """
+    if scheme not in FOLD_SCHEMES:
+        raise ValueError(f"Fold scheme '{scheme}' is not supported. Please choose from {FOLD_SCHEMES}")
+    if not isinstance(refit_every, (int, np.integer)) or isinstance(refit_every, bool) or refit_every < 1:
+        raise ValueError(f"refit_every must be a positive integer, got {refit_every!r}")
+    
+    min_train_samples = int(n * min_train_size)
+    test_samples = int(n * test_size)
+    window = int(n * (window_size if window_size is not None else min_train_size))
+    folds = []
+    
+    if scheme in ('expanding', 'sliding'):
+        step = (n - min_train_samples - gap - test_samples) // (n_splits - 1) if n_splits > 1 else 0
+        for i in range(n_splits):
+            train_end = min_train_samples + i * step
+            test_start = train_end + gap
+            test_end = min(test_start + test_samples, n)
+            if test_end <= test_start:
+                continue
+            train_start = 0 if scheme == 'expanding' else max(0, train_end - window)
+            folds.append(Fold(((train_start, train_end),), (test_start, test_end)))
+    
+    elif scheme == 'blocked':
+        bounds = np.linspace(0, n, n_splits + 1).astype(int)
+        for test_start, test_end in zip(bounds[:-1], bounds[1:]):
+            train = tuple((int(a), int(b)) for a, b in ((0, test_start - gap), (test_end + gap, n)) if b > a)
+            if not train or test_end <= test_start:
+                continue
+            folds.append(Fold(train, (int(test_start), int(test_end))))
+    
+    else:
+        if test_samples < 1:
+            raise ValueError("test_size is too small to build walk-forward test blocks")
+        for i, test_start in enumerate(range(min_train_samples + gap, n, test_samples)):
+            if i % refit_every == 0:
+                train_end = test_start - gap
+                train_start = 0 if window_size is None else max(0, train_end - window)
+                train = ((train_start, train_end),)
+            folds.append(Fold(train, (test_start, min(test_start + test_samples, n))))
+    
+    return folds
+
+
+def _group_folds(folds):
+    """Merge consecutive folds with the same training window (walk-forward between refits) so they share one fit"""
+    groups = []
+    for fold in folds:
+        if groups and groups[-1][0] == fold.train:
+            groups[-1][1].append(fold.test)
+        else:
+            groups.append((fold.train, [fold.test]))
+    return groups
+
+
+def _predict(model, formula, test_df):
+    """Predict with a fitted formula model, building the design matrix by hand if needed"""
+    try:
+        # Method 1: Try standard predict with dataframe
+        return model.predict(test_df)
+    except Exception:
+        # Method 2: Manually create design matrix when method 1 fails
+        # Get the exog variable names
+        exog_names = model.model.exog_names
+        # Get design matrix from test_df
+        X_test = dmatrix(formula.split('~')[1], data=test_df)
+        # Convert to DataFrame
+        X_test_df = pd.DataFrame(X_test, columns=X_test.design_info.column_names)
+        # Reorder columns to match model's exog_names (excluding Intercept)
+        X_test_df = X_test_df[exog_names[1:]]
+        # Add intercept
+        X_test_df.insert(0, 'Intercept', 1.0)
+        # Now predict
+        return model.predict(X_test_df)
+
+
+def _actuals(formula, test_df, name):
+    """Evaluate the left-hand side of `formula` (e.g. np.log(y + 10)) on the test rows"""
+    lhs = ModelDesc([], ModelDesc.from_formula(formula).lhs_termlist)
+    y = dmatrix(lhs, test_df, NA_action=NAAction(NA_types=[]))
+    return pd.Series(np.asarray(y)[:, 0], index=test_df.index, name=name)
+
+
+# Number of worker processes for n_jobs: -1 or None for all cores, otherwise a positive count
+def _n_workers(n_jobs):
+    if n_jobs is None or n_jobs == -1:
+        return os.cpu_count() or 1
+    if isinstance(n_jobs, (int, np.integer)) and not isinstance(n_jobs, bool) and n_jobs >= 1:
+        return int(n_jobs)
+    raise ValueError(f"n_jobs must be a positive integer, or -1 / None for all cores, got {n_jobs!r}")
+
+
+# Data shared with pool workers once, instead of pickling it with every fold
+_worker_data = {}
+
+
+def _init_worker(df, formula):
+    _worker_data['df'] = df
+    _worker_data['formula'] = formula
+
+
+def _fit_fold_group(train, tests, summary_only, df=None, formula=None):
+    """Fit one model on the `train` ranges and evaluate it on every range in `tests`"""
+    if df is None:
+        df = _worker_data['df']
+        formula = _worker_data['formula']
+    
+    train_df = pd.concat([df.iloc[start:stop] for start, stop in train])
+    model = ols(formula=formula, data=train_df).fit()
+    
+    fold_results = []
+    for test_start, test_end in tests:
+        test_df = df.iloc[test_start:test_end]
+        predictions = _predict(model, formula, test_df)
+        actuals = _actuals(formula, test_df, model.model.endog_names)
+        
+        fold = {
+            'mse': mean_squared_error(actuals, predictions),
+            'mae': mean_absolute_error(actuals, predictions),
+            'r2': r2_score(actuals, predictions),
+            'coefficients': model.params
+        }
+        if not summary_only:
+            fold['train_indices'] = [i for start, stop in train for i in range(start, stop)]
+            fold['test_indices'] = list(range(test_start, test_end))
+            fold['predictions'] = predictions
+            fold['actuals'] = actuals
+            fold['residuals'] = actuals - predictions
+            fold['models'] = model
+        fold_results.append(fold)
+    
+    return fold_results
+
+
 # Time series cross-validation function
-def time_series_cv(df, formula, n_splits=5, min_train_size=0.5, test_size=0.2):
+def time_series_cv(df, formula, n_splits=5, min_train_size=0.5, test_size=0.2,
+                   scheme='expanding', gap=0, window_size=None, refit_every=1,
+                   n_jobs=1, summary_only=False):
     """
-    Perform time series cross-validation with expanding window.
+    Perform time series cross-validation.
     
     Parameters:
     -----------
@@ -71,95 +253,181 @@ def time_series_cv(df, formula, n_splits=5, min_train_size=0.5, test_size=0.2):
         Minimum fraction of data to use for initial training
     test_size : float
         Fraction of data to use for each test set
+    scheme, gap, window_size, refit_every :
+        Fold layout, see `make_folds`. The default is an expanding window.
+    n_jobs : int
+        Number of worker processes for independent model fits (-1 or None for all cores)
+    summary_only : bool
+        Keep only coefficients and metrics per fold. Fitted models, index lists,
+        predictions and residuals are dropped so long backtests fit in memory.
     
     Returns:
     --------
     dict
-        Dictionary containing train/test indices, predictions, and metrics
+        Dictionary containing fold ranges, train/test indices, predictions, and metrics
     """
-    n = len(df)
-    min_train_samples = int(n * min_train_size)
-    test_samples = int(n * test_size)
+    folds = make_folds(len(df), scheme, n_splits, min_train_size, test_size,
+                       gap, window_size, refit_every)
+    
+    groups = _group_folds(folds)
+    max_workers = _n_workers(n_jobs)
+    
+    if max_workers == 1:
+        group_results = [_fit_fold_group(train, tests, summary_only, df, formula) for train, tests in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(df, formula)) as pool:
+            trains, tests = zip(*groups) if groups else ((), ())
+            chunksize = max(1, len(groups) // (4 * max_workers))
+            group_results = list(pool.map(_fit_fold_group, trains, tests,
+                                          repeat(summary_only), chunksize=chunksize))
     
     # Initialize results
-    results = {
-        'train_indices': [],
-        'test_indices': [],
-        'predictions': [],
-        'actuals': [],
-        'residuals': [],
-        'mse': [],
-        'mae': [],
-        'r2': [],
-        'coefficients': [],
-        'models': []
-    }
-    
-    # Create split indices
-    for i in range(n_splits):
-        if i == 0:
-            # First split uses minimum training size
-            train_end = min_train_samples
-        else:
-            # Subsequent splits expand the training window
-            train_end = min_train_samples + i * ((n - min_train_samples - test_samples) // (n_splits - 1))
+    keys = ['mse', 'mae', 'r2', 'coefficients']
+    if not summary_only:
+        keys = ['train_indices', 'test_indices', 'predictions', 'actuals', 'residuals'] + keys + ['models']
+    results = {key: [] for key in keys}
+    results['folds'] = folds
+    
+    # Store results
+    for fold_results in group_results:
+        for fold in fold_results:
+            for key in keys:
+                results[key].append(fold[key])
         
-        test_start = train_end
-        test_end = min(test_start + test_samples, n)
-        
-        if test_end <= test_start:
-            continue
+    return results
+
+
+def _rows(ranges):
+    return np.concatenate([np.arange(start, stop) for start, stop in ranges])
+
+
+def _init_search_worker(state):
+    _worker_data['search'] = state
+
+
+def _score_formulas(formula_columns, state=None):
+    """Evaluate the CV folds of each formula by selecting its columns from the shared design matrix"""
+    if state is None:
+        state = _worker_data['search']
+    X, targets, groups, grams = state['X'], state['targets'], state['groups'], state['grams']
+    
+    scores = []
+    for cols, target in formula_columns:
+        y = targets[target]
+        mse, mae, r2 = [], [], []
+        for (train, tests), gram in zip(groups, grams):
+            train_rows = _rows(train)
+            if gram is not None:
+                # Complete training rows: solve the sub-block of the cached normal equations
+                XtX, Xty = gram
+                beta = np.linalg.lstsq(XtX[np.ix_(cols, cols)], Xty[cols, target], rcond=None)[0]
+            else:
+                X_train, y_train = X[np.ix_(train_rows, cols)], y[train_rows]
+                complete = np.isfinite(X_train).all(axis=1) & np.isfinite(y_train)
+                beta = np.linalg.lstsq(X_train[complete], y_train[complete], rcond=None)[0]
             
-        # Extract train and test sets
-        train_indices = list(range(0, train_end))
-        test_indices = list(range(test_start, test_end))
-        
-        train_df = df.iloc[train_indices].copy()
-        test_df = df.iloc[test_indices].copy()
-        
-        # Fit OLS model
-        model = ols(formula=formula, data=train_df).fit()
-        
-        # Create design matrix for prediction using patsy - safer for time series
-        try:
-            # Method 1: Try standard predict with dataframe
-            predictions = model.predict(test_df)
-        except Exception:
-            # Method 2: Manually create design matrix when method 1 fails
-            # Get the exog variable names
-            exog_names = model.model.exog_names
-            # Get design matrix from test_df
-            X_test = dmatrix(formula.split('~')[1], data=test_df)
-            # Convert to DataFrame
-            X_test_df = pd.DataFrame(X_test, columns=X_test.design_info.column_names)
-            # Reorder columns to match model's exog_names (excluding Intercept)
-            X_test_df = X_test_df[exog_names[1:]]
-            # Add intercept
-            X_test_df.insert(0, 'Intercept', 1.0)
-            # Now predict
-            predictions = model.predict(X_test_df)
-        
-        actuals = test_df['y']
-        residuals = actuals - predictions
-        
-        # Calculate metrics
-        mse = mean_squared_error(actuals, predictions)
-        mae = mean_absolute_error(actuals, predictions)
-        r2 = r2_score(actuals, predictions)
+            for test in tests:
+                test_rows = np.arange(*test)
+                X_test, actuals = X[np.ix_(test_rows, cols)], y[test_rows]
+                complete = np.isfinite(X_test).all(axis=1) & np.isfinite(actuals)
+                if not complete.any():
+                    continue
+                actuals = actuals[complete]
+                residuals = actuals - X_test[complete] @ beta
+                mse.append(np.mean(residuals ** 2))
+                mae.append(np.mean(np.abs(residuals)))
+                r2.append(1 - np.sum(residuals ** 2) / np.sum((actuals - actuals.mean()) ** 2))
         
-        # Store results
-        results['train_indices'].append(train_indices)
-        results['test_indices'].append(test_indices)
-        results['predictions'].append(predictions)
-        results['actuals'].append(actuals)
-        results['residuals'].append(residuals)
-        results['mse'].append(mse)
-        results['mae'].append(mae)
-        results['r2'].append(r2)
-        results['coefficients'].append(model.params)
-        results['models'].append(model)
-        
-    return results
+        scores.append((np.mean(mse) if mse else np.nan,
+                       np.mean(mae) if mae else np.nan,
+                       np.mean(r2) if r2 else np.nan,
+                       len(mse)))
+    return scores
+
+
+def formula_search(df, formulas, n_splits=5, min_train_size=0.5, test_size=0.2,
+                   scheme='expanding', gap=0, window_size=None, refit_every=1,
+                   rank_by='mse', n_jobs=1):
+    """
+    Cross-validate many OLS formulas over a shared column pool and rank them.
+    
+    All right-hand-side terms are expanded once into a superset design matrix and
+    the normal equations of every training window are cached, so each formula only
+    selects and solves its own column block instead of re-slicing the data and
+    rebuilding patsy matrices. Categorical terms are coded as in the superset model.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Time series data with datetime index
+    formulas : list of str
+        Candidate formulas for OLS
+    n_splits, min_train_size, test_size, scheme, gap, window_size, refit_every :
+        Fold layout, see `make_folds`
+    rank_by : str
+        Metric used to rank the formulas ('mse', 'mae' or 'r2')
+    n_jobs : int
+        Number of worker processes for scoring formulas (-1 or None for all cores)
+    
+    Returns:
+    --------
+    pandas.DataFrame
+        Average MSE, MAE and R² over the folds per formula, best formula first
+    """
+    if rank_by not in ('mse', 'mae', 'r2'):
+        raise ValueError(f"Cannot rank by '{rank_by}'. Please choose from ['mse', 'mae', 'r2']")
+    max_workers = _n_workers(n_jobs)
+    
+    descs = [ModelDesc.from_formula(formula) for formula in formulas]
+    rhs_terms = list(dict.fromkeys(term for desc in descs for term in desc.rhs_termlist))
+    lhs_terms = list(dict.fromkeys(tuple(desc.lhs_termlist) for desc in descs))
+    
+    # One superset design matrix; NaNs are kept so every formula can drop its own incomplete rows
+    keep_na = NAAction(NA_types=[])
+    X = dmatrix(ModelDesc([], rhs_terms), df, NA_action=keep_na)
+    term_columns = {term: np.arange(s.start, s.stop) for term, s in X.design_info.term_slices.items()}
+    X = np.asarray(X)
+    Y = np.column_stack([np.asarray(dmatrix(ModelDesc([], list(lhs)), df, NA_action=keep_na))
+                         for lhs in lhs_terms])
+    
+    folds = make_folds(len(df), scheme, n_splits, min_train_size, test_size,
+                       gap, window_size, refit_every)
+    groups = _group_folds(folds)
+    
+    # Cache X'X and X'Y per training window when the window has no missing values
+    grams = []
+    for train, _ in groups:
+        train_rows = _rows(train)
+        X_train, Y_train = X[train_rows], Y[train_rows]
+        if np.isfinite(X_train).all() and np.isfinite(Y_train).all():
+            grams.append((X_train.T @ X_train, X_train.T @ Y_train))
+        else:
+            grams.append(None)
+    
+    state = {'X': X, 'targets': list(Y.T), 'groups': groups, 'grams': grams}
+    lhs_index = {lhs: i for i, lhs in enumerate(lhs_terms)}
+    formula_columns = [(np.concatenate([term_columns[term] for term in desc.rhs_termlist]),
+                        lhs_index[tuple(desc.lhs_termlist)]) for desc in descs]
+    
+    if max_workers == 1:
+        scores = _score_formulas(formula_columns, state)
+    else:
+        n_chunks = 4 * max_workers
+        chunks = [formula_columns[i::n_chunks] for i in range(n_chunks)]
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_search_worker,
+                                 initargs=(state,)) as pool:
+            chunk_scores = list(pool.map(_score_formulas, chunks))
+        # Undo the round-robin chunking
+        scores = [None] * len(formula_columns)
+        for i, chunk in enumerate(chunk_scores):
+            scores[i::n_chunks] = chunk
+    
+    ranking = pd.DataFrame(scores, columns=['mse', 'mae', 'r2', 'n_folds'])
+    ranking.insert(0, 'formula', list(formulas))
+    ranking = ranking.sort_values(rank_by, ascending=(rank_by != 'r2')).reset_index(drop=True)
+    
+    return ranking
 
 # Visualize cross-validation results
 def plot_cv_results(df, cv_results, n_splits):
@@ -250,6 +518,129 @@ def plot_cv_results(df, cv_results, n_splits):
     plt.tight_layout()
     plt.show()
 
+# Tabular cross-validation report for batch jobs
+def cv_report(df, cv_results, figure_path=None):
+    """
+    Summarise cross-validation results as tables, without any interactive plotting.
+    
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Time series data used for the cross-validation
+    cv_results : dict
+        Output of `time_series_cv` (also works with summary_only results)
+    figure_path : str, optional
+        If given, all diagnostics are drawn into one figure and saved there with
+        the non-GUI Agg backend. Leave as None to skip rendering entirely.
+    
+    Returns:
+    --------
+    dict
+        'metrics' - MSE, MAE and R² with the fold layout, one row per fold
+        'coefficients' - coefficient evolution, one row per fold
+        'residuals' - residual summary statistics per fold (full results only)
+    """
+    folds = cv_results['folds']
+    fold_index = pd.RangeIndex(1, len(folds) + 1, name='fold')
+    
+    metrics = pd.DataFrame({
+        'train_size': [sum(stop - start for start, stop in fold.train) for fold in folds],
+        'test_start': df.index[[fold.test[0] for fold in folds]],
+        'test_end': df.index[[fold.test[1] - 1 for fold in folds]],
+        'mse': cv_results['mse'],
+        'mae': cv_results['mae'],
+        'r2': cv_results['r2']
+    }, index=fold_index)
+    coefficients = pd.DataFrame(list(cv_results['coefficients']), index=fold_index)
+    report = {'metrics': metrics, 'coefficients': coefficients}
+    
+    if 'residuals' in cv_results:
+        lengths = [len(residuals) for residuals in cv_results['residuals']]
+        residuals = pd.Series(np.concatenate([np.asarray(r) for r in cv_results['residuals']]))
+        report['residuals'] = residuals.groupby(np.repeat(fold_index, lengths)).describe()
+        report['residuals'].index.name = 'fold'
+    
+    if figure_path is not None:
+        _render_cv_figure(df, cv_results, report, figure_path)
+    
+    return report
+
+
+def _render_cv_figure(df, cv_results, report, figure_path):
+    """Draw the cv_report diagnostics into a single figure and save it with the Agg backend"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    full = 'residuals' in cv_results
+    fig = Figure(figsize=(15, 20 if full else 8))
+    FigureCanvasAgg(fig)
+    grid = fig.add_gridspec(5 if full else 2, 2)
+    fold_nums = report['metrics'].index
+    
+    # 1. MSE, MAE and R² for each fold
+    ax = fig.add_subplot(grid[0, 0])
+    ax.plot(fold_nums, report['metrics'][['mse', 'mae']].values, 'o-')
+    ax.set_title('Error Metrics Across CV Folds')
+    ax.set_xlabel('Fold Number')
+    ax.set_xticks(fold_nums)
+    ax.set_ylabel('Error Value')
+    ax.legend(['MSE', 'MAE'])
+    
+    ax = fig.add_subplot(grid[0, 1])
+    ax.plot(fold_nums, report['metrics']['r2'], 'o-', color='green', label='R²')
+    ax.set_title('R² Across CV Folds')
+    ax.set_xlabel('Fold Number')
+    ax.set_xticks(fold_nums)
+    ax.set_ylabel('R² Value')
+    ax.legend()
+    
+    # 2. Coefficient evolution
+    ax = fig.add_subplot(grid[1, :])
+    ax.plot(fold_nums, report['coefficients'].values, 'o-')
+    ax.set_title('Coefficient Evolution Across CV Folds')
+    ax.set_xlabel('Fold Number')
+    ax.set_xticks(fold_nums)
+    ax.set_ylabel('Coefficient Value')
+    ax.legend(report['coefficients'].columns, loc='upper left', bbox_to_anchor=(1.01, 1))
+    
+    if full:
+        # One scatter per series with folds as colours instead of one line per fold
+        test_dates = df.index[np.concatenate([np.asarray(idx) for idx in cv_results['test_indices']])]
+        fold_labels = np.repeat(fold_nums, [len(idx) for idx in cv_results['test_indices']])
+        actuals = np.concatenate([np.asarray(a) for a in cv_results['actuals']])
+        predictions = np.concatenate([np.asarray(p) for p in cv_results['predictions']])
+        residuals = np.concatenate([np.asarray(r) for r in cv_results['residuals']])
+        
+        # 3. Original time series
+        ax = fig.add_subplot(grid[2, :])
+        ax.plot(df.index, df[cv_results['actuals'][0].name], label='Original Time Series')
+        ax.set_title('Original Time Series Data')
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Value')
+        ax.legend()
+        
+        # 4. Predictions vs actuals
+        ax = fig.add_subplot(grid[3, :])
+        ax.scatter(test_dates, actuals, c=fold_labels, marker='o', alpha=0.7, label='Actual')
+        ax.scatter(test_dates, predictions, c=fold_labels, marker='s', alpha=0.7, label='Predicted')
+        ax.set_title('Actual vs Predicted Values Across CV Folds')
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Value')
+        ax.legend()
+        
+        # 5. Residuals
+        ax = fig.add_subplot(grid[4, :])
+        points = ax.scatter(test_dates, residuals, c=fold_labels, alpha=0.7)
+        ax.axhline(y=0, color='r', linestyle='-')
+        ax.set_title('Residuals Across CV Folds')
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Residual')
+        fig.colorbar(points, ax=ax, label='Fold')
+    
+    fig.tight_layout()
+    fig.savefig(figure_path)
+
+
 # Main execution
 if __name__ == "__main__":
     # Generate sample data
@@ -292,8 +683,12 @@ if __name__ == "__main__":
     print("\nFinal Model Summary (Last Fold):")
     print(cv_results['models'][-1].summary())
     
-    # Plot cross-validation results
-    plot_cv_results(df, cv_results, len(cv_results['mse']))
+    # Plot cross-validation results (pass --headless for scheduled runs)
+    if '--headless' in sys.argv:
+        report = cv_report(df, cv_results, figure_path='cv_report.png')
+        print(report['residuals'])
+    else:
+        plot_cv_results(df, cv_results, len(cv_results['mse']))
 
     print("\nAnalysis complete!")
 
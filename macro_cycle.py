@@ -1,31 +1,29 @@
+import warnings
 import numpy as np
+from collections import OrderedDict
+from scipy.optimize import brentq
 from scipy.stats import norm
 
 def inverse_matrix(transition_matrix):
     """
     Calculate the inverse matrix for a given transition matrix.
 
-    The function iterates through each element of the transition matrix and fills
-    the inverse matrix with values calculated using the normal cumulative distribution function (CDF).
-    The CDF is applied to the sum of probabilities from the current state to the end.
+    Each element of the inverse matrix is the standard normal quantile (inverse CDF)
+    of the sum of probabilities from the current state to the end of the row.
+    All cumulative sums come from one reverse cumulative sum and a single `norm.ppf` call.
 
     Parameters:
-    transition_matrix (numpy.ndarray): A 2D array representing the transition matrix.
+    transition_matrix (numpy.ndarray): A 2D array representing the transition matrix,
+        or a stack of them with the states in the last two axes.
 
     Returns:
     numpy.ndarray: The inverse matrix corresponding to the input transition matrix.
     """
-    # Initialize an empty matrix of the same shape as the transition matrix
-    inverse_matrix = np.zeros(transition_matrix.shape)
+    transition_matrix = np.asarray(transition_matrix, dtype=float)
+    cumulative_prob = np.cumsum(transition_matrix[..., ::-1], axis=-1)[..., ::-1]
 
-    # Iterate through the transition matrix and calculate the inverse values
-    for i, row in enumerate(transition_matrix):
-        for j, _ in enumerate(row):
-            cumulative_prob = np.sum(transition_matrix[i, j:], axis=0)
-            # Ensure the cumulative probability is at most 1
-            inverse_matrix[i, j] = norm.ppf(min(1, cumulative_prob))
-
-    return inverse_matrix
+    # Ensure the cumulative probability is at most 1
+    return norm.ppf(np.minimum(1, cumulative_prob))
 
 def generate_pit_matrix(inverse_ttc, rho, z_score):
     """
@@ -43,20 +41,291 @@ def generate_pit_matrix(inverse_ttc, rho, z_score):
     Returns:
     numpy.ndarray: The Point-in-Time (PIT) transition matrix.
     """
-    pit_matrix = np.zeros(inverse_ttc.shape)
+    return generate_pit_matrices(inverse_ttc, rho, z_score)
+
+def generate_pit_matrices(inverse_ttc, rhos, z_scores):
+    """
+    Generate Point-in-Time (PIT) transition matrices for many (rho, Z-score) pairs at once.
+
+    rhos and z_scores are broadcast against each other, and the result has their
+    broadcast shape followed by the matrix shape, e.g. a (scenarios, n, n) tensor
+    for arrays of scenario Z-scores. inverse_ttc may itself be a stack of matrices
+    (e.g. one per segment) that broadcasts with the parameter shape.
+
+    Parameters:
+    inverse_ttc (numpy.ndarray): Inverse Through-the-Cycle (TTC) matrix or matrices.
+    rhos (float or numpy.ndarray): Correlation coefficients.
+    z_scores (float or numpy.ndarray): Z-scores from a normal distribution.
+
+    Returns:
+    numpy.ndarray: The Point-in-Time (PIT) transition matrices.
+    """
+    rhos = np.asarray(rhos, dtype=float)[..., None, None]
+    z_scores = np.asarray(z_scores, dtype=float)[..., None, None]
+
+    adjusted = norm.cdf((inverse_ttc - rhos * z_scores) / np.sqrt(1 - rhos**2))
+
+    pit_matrices = np.empty(adjusted.shape)
+    pit_matrices[..., :-1] = adjusted[..., :-1] - adjusted[..., 1:]
+
+    # Adjust the last column to ensure rows sum to 1
+    pit_matrices[..., -1] = 1 - np.sum(pit_matrices[..., :-1], axis=-1)
+
+    return pit_matrices
+
+def pit_default_rates(inverse_ttc, rho, z_scores):
+    """
+    Default column of the PIT matrices and its derivative with respect to the Z-score.
+
+    Parameters:
+    inverse_ttc (numpy.ndarray): An inverse Through-the-Cycle (TTC) matrix.
+    rho (float): Correlation coefficient.
+    z_scores (numpy.ndarray): Z-scores, one per period.
+
+    Returns:
+    numpy.ndarray: PIT default probabilities of shape (periods, grades).
+    numpy.ndarray: Their derivatives with respect to the Z-score.
+    """
+    scale = np.sqrt(1 - rho**2)
+    z_scores = np.asarray(z_scores, dtype=float)[:, None]
+
+    # The PIT row telescopes, so the default column is 1 - cdf(first) + cdf(last)
+    first = (inverse_ttc[:, 0] - rho * z_scores) / scale
+    last = (inverse_ttc[:, -1] - rho * z_scores) / scale
+    default_rates = 1 - norm.cdf(first) + norm.cdf(last)
+    derivatives = rho / scale * (norm.pdf(first) - norm.pdf(last))
+
+    return default_rates, derivatives
+
+def _solve_z_scores(inverse_ttc, rho, default_rates, weights, z_scores, tol, max_iter):
+    """Safeguarded Newton iterations on all periods at once"""
+    lower = np.full(len(default_rates), -10.0)
+    upper = np.full(len(default_rates), 10.0)
+    z_scores = np.clip(z_scores, lower, upper)
+
+    for _ in range(max_iter):
+        pit_rates, derivatives = pit_default_rates(inverse_ttc, rho, z_scores)
+        error = np.sum(weights * pit_rates, axis=1) - default_rates
+        slope = np.sum(weights * derivatives, axis=1)
+
+        # The PIT default rate falls as Z rises, which gives a bracket for each root
+        lower = np.where(error > 0, z_scores, lower)
+        upper = np.where(error < 0, z_scores, upper)
+        if np.max(np.abs(error)) < tol:
+            break
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = z_scores - error / slope
+        inside = np.isfinite(newton) & (newton > lower) & (newton < upper)
+        z_scores = np.where(inside, newton, (lower + upper) / 2)
+    else:
+        pit_rates, _ = pit_default_rates(inverse_ttc, rho, z_scores)
+        error = np.sum(weights * pit_rates, axis=1) - default_rates
+
+    # Targets out of reach end on the [-10, 10] bound with the error still above tol
+    return z_scores, np.abs(error) < tol
+
+def _converged_z_scores(z_scores, converged):
+    """Z-scores with NaN, and a warning, for the periods whose default rate was not matched"""
+    if not converged.all():
+        periods = np.flatnonzero(~converged)
+        warnings.warn(f"The Z-score did not converge for periods {periods.tolist()}; their default rates "
+                      "cannot be reached within z in [-10, 10] and they are set to NaN.", RuntimeWarning)
+    return np.where(converged, z_scores, np.nan)
+
+def calibrate_z_scores(inverse_ttc, default_rates, rho, weights=None, fit_rho=False, z0=None,
+                       tol=1e-10, max_iter=100):
+    """
+    Solve for the Z-score of each period so that PIT default rates match observed ones.
+
+    All periods are solved together by Newton's method on the default column of the
+    PIT matrix, using its analytic derivative and falling back to bisection when a
+    step leaves the bracket. Optionally one rho is fitted across the sample, such that
+    the calibrated Z-scores have unit mean square as under a standard normal factor.
+
+    Parameters:
+    inverse_ttc (numpy.ndarray): An inverse Through-the-Cycle (TTC) matrix.
+    default_rates (numpy.ndarray): Observed portfolio default rates, one per period.
+    rho (float): Correlation coefficient, or the starting point when fit_rho is True.
+    weights (numpy.ndarray, optional): Portfolio mix over the grades, either one row for
+        all periods or one per period. Defaults to equal weights.
+    fit_rho (bool): Whether to fit rho across the sample as well.
+    z0 (numpy.ndarray, optional): Starting Z-scores, e.g. last year's calibration. Periods
+        beyond its length start from its last value, i.e. from the previous year.
+        Defaults to a closed-form single-grade approximation.
+    tol (float): Tolerance on the default rate error.
+    max_iter (int): Maximum number of Newton iterations.
+
+    Returns:
+    numpy.ndarray: Calibrated Z-scores, one per period. Periods whose default rate cannot
+        be matched within tol are NaN, with a RuntimeWarning naming them.
+    float: The correlation coefficient used (fitted if fit_rho is True).
+    """
+    inverse_ttc = np.asarray(inverse_ttc, dtype=float)
+    default_rates = np.asarray(default_rates, dtype=float)
+    n_periods, n_grades = len(default_rates), inverse_ttc.shape[0]
+    if weights is None:
+        weights = np.full(n_grades, 1 / n_grades)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), (n_periods, n_grades))
+
+    if z0 is None:
+        ttc_rates, _ = pit_default_rates(inverse_ttc, 0.0, np.zeros(n_periods))
+        ttc_rate = np.sum(weights * ttc_rates, axis=1)
+        z0 = np.sqrt(1 - rho**2) * (norm.ppf(ttc_rate) - norm.ppf(default_rates)) / rho
+    else:
+        z0 = np.asarray(z0, dtype=float)
+        z0 = np.concatenate([z0, np.full(n_periods - len(z0), z0[-1])])[:n_periods]
+
+    if not fit_rho:
+        return _converged_z_scores(*_solve_z_scores(inverse_ttc, rho, default_rates, weights, z0, tol, max_iter)), rho
+
+    # Each solve for a trial rho is warm-started from the previous one
+    state = {'z_scores': z0}
+
+    def excess_variance(trial_rho):
+        state['z_scores'], _ = _solve_z_scores(inverse_ttc, trial_rho, default_rates, weights,
+                                               state['z_scores'], tol, max_iter)
+        return np.mean(state['z_scores']**2) - 1
+
+    # The moment condition need not be monotone in rho: bracket its first root on a grid
+    grid = np.linspace(1e-3, 0.99, 100)
+    values = [excess_variance(trial_rho) for trial_rho in grid]
+    crossings = np.flatnonzero(np.diff(np.sign(values)) != 0)
+    if len(crossings) == 0:
+        raise ValueError("No rho in (0, 1) gives calibrated Z-scores with unit mean square.")
+    excess_variance(grid[crossings[0]])
+    rho = brentq(excess_variance, grid[crossings[0]], grid[crossings[0] + 1], xtol=1e-8)
+    z_scores, converged = _solve_z_scores(inverse_ttc, rho, default_rates, weights, state['z_scores'], tol, max_iter)
+    return _converged_z_scores(z_scores, converged), rho
+
+class PITProjector:
+    """
+    Project cumulative default probabilities by chaining one-year PIT matrices along macro paths.
+
+    PIT matrices and their powers are cached per (rho, z_score) with least-recently-used
+    eviction, so values repeated across periods and scenarios are built once, and the
+    flat tail of a path (e.g. after reverting to z = 0) is covered by cached matrix powers.
+
+    Parameters:
+    inverse_ttc (numpy.ndarray): An inverse Through-the-Cycle (TTC) matrix with the default
+        state in the last column. If it has one row fewer than columns, an absorbing
+        default row is appended so the matrices can be chained.
+    maxsize (int): Maximum number of (rho, z_score) entries kept in the cache.
+    """
+
+    def __init__(self, inverse_ttc, maxsize=256):
+        self.inverse_ttc = np.asarray(inverse_ttc, dtype=float)
+        n_rows, n_states = self.inverse_ttc.shape
+        if n_rows not in (n_states, n_states - 1):
+            raise ValueError("The TTC matrix must be square or lack only the default row.")
+        self.n_grades = n_states - 1
+        self.maxsize = maxsize
+        self._cache = OrderedDict()  # (rho, z_score) -> powers [M, M^2, ..., M^k]
+
+    def _square(self, pit_matrices):
+        """Add the absorbing default row to PIT matrices without one"""
+        n_rows, n_states = pit_matrices.shape[-2:]
+        if n_rows == n_states:
+            return pit_matrices
+        square = np.zeros(pit_matrices.shape[:-2] + (n_states, n_states))
+        square[..., :n_rows, :] = pit_matrices
+        square[..., -1, -1] = 1
+        return square
+
+    def _store(self, key, powers):
+        self._cache[key] = powers
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def matrices(self, rhos, z_scores):
+        """
+        Square PIT matrices for arrays of (rho, z_score) pairs, built only for pairs not in the cache.
+
+        Returns:
+        numpy.ndarray: Matrices of shape (pairs, n_states, n_states).
+        """
+        keys = list(zip(np.asarray(rhos, dtype=float).tolist(), np.asarray(z_scores, dtype=float).tolist()))
+
+        # Collect the cache hits before storing anything, so evictions made while storing
+        # the new matrices cannot drop a pair this call still needs
+        found = {}
+        for key in dict.fromkeys(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                found[key] = self._cache[key][0]
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            built = self._square(generate_pit_matrices(self.inverse_ttc, *np.array(missing).T))
+            for key, matrix in zip(missing, built):
+                found[key] = matrix
+                self._store(key, matrix[None])
+        return np.stack([found[key] for key in keys])
+
+    def powers(self, rho, z_score, k):
+        """
+        The first k powers of the square PIT matrix for (rho, z_score), extending the cached ones if needed.
+
+        Returns:
+        numpy.ndarray: Matrices of shape (k, n_states, n_states), the i-th being M^(i+1).
+        """
+        key = (float(rho), float(z_score))
+        # Work on a local copy of the powers; the cache is only written back at the end
+        powers = self._cache.get(key)
+        if powers is None:
+            powers = self.matrices([rho], [z_score])
+        if len(powers) < k:
+            extended = np.empty((k,) + powers.shape[1:])
+            extended[: len(powers)] = powers
+            for i in range(len(powers), k):
+                extended[i] = extended[i - 1] @ extended[0]
+            powers = extended
+        self._store(key, powers)
+        return powers[:k]
+
+    def project(self, z_paths, rho):
+        """
+        Cumulative default probabilities along macro paths, per starting grade.
+
+        Parameters:
+        z_paths (numpy.ndarray): Z-scores of shape (scenarios, periods), or (periods,) for one path.
+        rho (float or numpy.ndarray): Correlation coefficient, scalar or broadcastable to z_paths.
+
+        Returns:
+        numpy.ndarray: Cumulative probability of being in default at the end of each period,
+            of shape (scenarios, periods, grades), or (periods, grades) for one path.
+        """
+        single_path = np.ndim(z_paths) == 1
+        z_paths = np.atleast_2d(np.asarray(z_paths, dtype=float))
+        rhos = np.broadcast_to(np.asarray(rho, dtype=float), z_paths.shape)
+        n_scenarios, n_periods = z_paths.shape
+        n_states = self.n_grades + 1
+
+        # Each path is split into a head and a flat tail that repeats one (rho, z_score) to the end
+        same = (z_paths[:, 1:] == z_paths[:, :-1]) & (rhos[:, 1:] == rhos[:, :-1])
+        tail_length = np.cumprod(same[:, ::-1], axis=1).sum(axis=1)
+        tail_start = n_periods - 1 - tail_length
 
-    # Iterate through the inverse TTC matrix to fill the PIT matrix
-    for i, row in enumerate(inverse_ttc):
-        for j, _ in enumerate(row):
-            if j < inverse_ttc.shape[1] - 1:
-                adjusted_value = (inverse_ttc[i, j] - rho * z_score) / np.sqrt(1 - rho**2)
-                next_adjusted_value = (inverse_ttc[i, j+1] - rho * z_score) / np.sqrt(1 - rho**2)
-                pit_matrix[i, j] = norm.cdf(adjusted_value) - norm.cdf(next_adjusted_value)
+        # Head: step all scenarios through time with batched matmul
+        cumulative = np.broadcast_to(np.identity(n_states), (n_scenarios, n_states, n_states)).copy()
+        default_prob = np.empty((n_scenarios, n_periods, self.n_grades))
+        for t in range(tail_start.max()):
+            head = np.flatnonzero(t < tail_start)
+            cumulative[head] = cumulative[head] @ self.matrices(rhos[head, t], z_paths[head, t])
+            default_prob[head, t] = cumulative[head, : self.n_grades, -1]
 
-        # Adjust the last column to ensure row sums to 1
-        pit_matrix[i, -1] = 1 - np.sum(pit_matrix[i, :-1])
+        # Tail: multiply by the cached powers of the repeated matrix
+        tails = np.column_stack([rhos[np.arange(n_scenarios), tail_start],
+                                 z_paths[np.arange(n_scenarios), tail_start], tail_start])
+        groups, group_index = np.unique(tails, axis=0, return_inverse=True)
+        for g, (rho_tail, z_tail, start) in enumerate(groups):
+            members = np.flatnonzero(group_index.ravel() == g)
+            start = int(start)
+            powers = self.powers(rho_tail, z_tail, n_periods - start)
+            chained = cumulative[members][:, None] @ powers[None]
+            default_prob[members, start:] = chained[..., : self.n_grades, -1]
 
-    return pit_matrix
+        return default_prob[0] if single_path else default_prob
 
 # Example usage of the functions
 ttc_matrix = np.array([[0.89, 0.01, 0.05, 0.05], [0.1, 0.6, 0.1, 0.2], [0.1, 0.2, 0.4, 0.3]])
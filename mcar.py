@@ -2,11 +2,12 @@
 # Author: Rianne Schouten <https://rianneschouten.github.io/>
 # Co-Author: Davina Zamanzadeh <https://davinaz.me/>
 
-from logging import error
+from logging import error, warning
 import numpy as np
 import pandas as pd
-from math import pow
-from scipy.stats import chi2, ttest_ind
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse import csr_matrix
+from scipy.stats import chi2, t
 
 # Local
 from pyampute.utils import Matrix
@@ -25,6 +26,15 @@ class MCARTest:
     method : str, {"little", "ttest"}, default : "little"
         Whether to perform a chi-square test on the entire dataset ("little") or separate t-tests for every combination of variables ("ttest"). 
 
+    estimator : str, {"pairwise", "em"}, default : "pairwise"
+        How Little's test estimates the mean and covariance: pairwise-complete moments ("pairwise") or maximum likelihood via the EM algorithm ("em").
+
+    tol : float, default : 1e-4
+        Convergence tolerance of the EM algorithm, see :meth:`em_mean_cov`.
+
+    max_iter : int, default : 100
+        Maximum number of EM iterations.
+
     See also
     --------
     :class:`~pyampute.exploration.md_patterns.mdPatterns` : Displays missing data patterns in incomplete datasets
@@ -47,12 +57,17 @@ class MCARTest:
     0.17365464213775494    
     """
 
-    def __init__(self, method: str = "little"):
+    def __init__(
+        self, method: str = "little", estimator: str = "pairwise", tol: float = 1e-4, max_iter: int = 100
+    ):
         self.method = method
+        self.estimator = estimator
+        self.tol = tol
+        self.max_iter = max_iter
 
     def __call__(self, data: Matrix) -> float:
         if self.method == "little":
-            return self.little_mcar_test(data)
+            return self.little_mcar_test(data, self.estimator, self.tol, self.max_iter)
         elif self.method == "ttest":
             return self.mcar_t_tests(data)
         else:
@@ -61,63 +76,89 @@ class MCARTest:
             )
 
     @staticmethod
-    def little_mcar_test(X: Matrix) -> float:
+    def little_mcar_test(
+        X: Matrix, estimator: str = "pairwise", tol: float = 1e-4, max_iter: int = 100
+    ) -> float:
         """
         Implementation of Little's MCAR test
-        
+
+        Rows are grouped by missing data pattern once, so the statistic only needs per-pattern counts and sums.
+
         Parameters
         ----------
         X : Matrix of shape `(n, m)`
             Dataset with missing values. `n` rows (samples) and `m` columns (features).
 
+        estimator : str, {"pairwise", "em"}, default : "pairwise"
+            Use pairwise-complete moments or maximum likelihood (EM) estimates of the mean and covariance.
+
+        tol : float, default : 1e-4
+            Convergence tolerance of the EM algorithm.
+
+        max_iter : int, default : 100
+            Maximum number of EM iterations.
+
         Returns
         -------
         pvalue : float
             The p-value of a chi-square hypothesis test. Null hypothesis: data is Missing Completely At Random (MCAR). Alternative hypothesis: data is not MCAR.
         """
 
-        dataset = X.copy()
-        vars = dataset.dtypes.index.values
-        n_var = dataset.shape[1]
+        patterns = _MissingPatterns(X)
 
         # mean and covariance estimates
-        # ideally, this is done with a maximum likelihood estimator
-        gmean = dataset.mean()
-        gcov = dataset.cov()
-
-        # set up missing data patterns
-        r = 1 * dataset.isnull()
-        mdp = np.dot(r, list(map(lambda x: pow(2, x), range(n_var))))
-        sorted_mdp = sorted(np.unique(mdp))
-        n_pat = len(sorted_mdp)
-        correct_mdp = list(map(lambda x: sorted_mdp.index(x), mdp))
-        dataset["mdp"] = pd.Series(correct_mdp, index=dataset.index)
+        if estimator == "pairwise":
+            gmean, gcov = patterns.pairwise_mean_cov()
+        elif estimator == "em":
+            gmean, gcov = patterns.em_mean_cov(tol, max_iter)
+        else:
+            raise ValueError(
+                f"Chose {estimator} as estimator, which is not supported. Please choose from [pairwise, em]."
+            )
 
         # calculate statistic and df
-        pj = 0
-        d2 = 0
-        for i in range(n_pat):
-            dataset_temp = dataset.loc[dataset["mdp"] == i, vars]
-            select_vars = ~dataset_temp.isnull().any()
-            pj += np.sum(select_vars)
-            select_vars = vars[select_vars]
-            means = dataset_temp[select_vars].mean() - gmean[select_vars]
-            select_cov = gcov.loc[select_vars, select_vars]
-            mj = len(dataset_temp)
-            parta = np.dot(
-                means.T, np.linalg.solve(select_cov, np.identity(select_cov.shape[1]))
-            )
-            d2 += mj * (np.dot(parta, means))
+        d2, pj = patterns.little_statistic(gmean, gcov)
 
-        df = pj - n_var
+        df = pj - patterns.n_var
 
         # perform test and save output
-        pvalue = 1 - chi2.cdf(d2, df)
+        pvalue = chi2.sf(d2, df)
 
         return pvalue
 
     @staticmethod
-    def mcar_t_tests(X: Matrix) -> pd.DataFrame:
+    def em_mean_cov(
+        X: Matrix, tol: float = 1e-4, max_iter: int = 100, init: tuple = None
+    ) -> tuple:
+        """
+        Maximum likelihood estimates of the mean and covariance of multivariate normal data with missing values, using the EM algorithm.
+
+        Each EM step works on per-pattern sufficient statistics, so its cost grows with the number of missing data patterns rather than the number of rows.
+
+        Parameters
+        ----------
+        X : Matrix of shape `(n, m)`
+            Dataset with missing values. `n` rows (samples) and `m` columns (features).
+
+        tol : float, default : 1e-4
+            The iterations stop when no mean or covariance entry changes by more than `tol`, relative to the standard deviations of the features involved.
+
+        max_iter : int, default : 100
+            Maximum number of EM iterations.
+
+        init : tuple of (mean, cov), optional
+            Starting values, e.g. estimates from a previous run on similar data. Defaults to the pairwise means and variances.
+
+        Returns
+        -------
+        mean : numpy array of shape `(m,)`
+
+        cov : numpy array of shape `(m, m)`
+        """
+        return _MissingPatterns(X).em_mean_cov(tol, max_iter, init)
+
+    @staticmethod
+    def mcar_t_tests(X: Matrix, chunk_size: int = 100_000) -> pd.DataFrame:
         """
         Performs t-tests for MCAR for each pair of features.
 
@@ -126,25 +167,224 @@ class MCARTest:
         X : Matrix of shape `(n, m)`
             Dataset with missing values. `n` rows (samples) and `m` columns (features).
 
+        chunk_size : int, default : 100000
+            Number of rows processed at once. All pairs are tested together from masked counts, sums and sums of squares.
+
         Returns
         -------
         pvalues : pandas DataFrame of shape `(m, m)`
             The p-values of t-tests for each pair of features. Null hypothesis for cell :math:`pvalues[h,j]`: data in feature :math:`h` is Missing Completely At Random (MCAR) with respect to feature :math:`j` for all :math:`h,j` in :math:`{1,2,...m}`. Diagonal values do not exist. 
         """
-        dataset = X.copy()
-        vars = dataset.dtypes.index.values
-        mcar_matrix = pd.DataFrame(
-            data=np.zeros(shape=(dataset.shape[1], dataset.shape[1])),
-            columns=vars,
-            index=vars,
-        )
-
-        for var in vars:
-            for tvar in vars:
-                part_one = dataset.loc[dataset[var].isnull(), tvar].dropna()
-                part_two = dataset.loc[~dataset[var].isnull(), tvar].dropna()
-                mcar_matrix.loc[var, tvar] = ttest_ind(
-                    part_one, part_two, equal_var=False
-                ).pvalue
+        values = np.asarray(X, dtype=float)
+        vars = X.columns.values if isinstance(X, pd.DataFrame) else np.arange(values.shape[1])
+        n_var = values.shape[1]
+
+        # Counts, sums and sums of squares of feature j over the rows where feature h is missing
+        # (first block) or observed (second block), as one matrix product per chunk of rows.
+        # Data are centred on the column means for numerical stability.
+        center = np.nanmean(values, axis=0)
+        moments = np.zeros((2 * n_var, 3 * n_var))
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start : start + chunk_size] - center
+            missing = np.isnan(chunk)
+            chunk[missing] = 0
+            groups = np.hstack([missing, ~missing]).astype(float)
+            moments += groups.T @ np.hstack([1.0 - missing, chunk, chunk**2])
+
+        count, total, squares = np.split(moments, 3, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / count
+            var_of_mean = (squares - total * mean) / (count - 1) / count
+            mean_one, mean_two = np.split(mean, 2)
+            vm_one, vm_two = np.split(var_of_mean, 2)
+            n_one, n_two = np.split(count, 2)
+
+            # Welch's t-test
+            tstat = (mean_one - mean_two) / np.sqrt(vm_one + vm_two)
+            dof = (vm_one + vm_two) ** 2 / (vm_one**2 / (n_one - 1) + vm_two**2 / (n_two - 1))
+        pvalues = 2 * t.sf(np.abs(tstat), dof)
+
+        mcar_matrix = pd.DataFrame(data=pvalues, columns=vars, index=vars)
 
         return mcar_matrix[mcar_matrix.notnull()]
+
+
+class _MissingPatterns:
+    """
+    Rows of a dataset grouped by missing data pattern.
+
+    The missingness mask is bit-packed into one integer key per row (one byte per 8 features), so grouping
+    is a single :func:`numpy.unique` call. Per-pattern sums and the cross-product matrix are then accumulated
+    in one chunked pass over the rows.
+    """
+
+    def __init__(self, X: Matrix, chunk_size: int = 100_000):
+        self.values = np.asarray(X, dtype=float)
+        self.chunk_size = chunk_size
+        n, self.n_var = self.values.shape
+
+        mask = np.isnan(self.values)
+        packed = np.packbits(mask, axis=1)
+        if packed.shape[1] <= 8:
+            keys = np.zeros((n, 8), dtype=np.uint8)
+            keys[:, : packed.shape[1]] = packed
+            _, first, inverse = np.unique(
+                keys.view(np.uint64).ravel(), return_index=True, return_inverse=True
+            )
+        else:
+            _, first, inverse = np.unique(
+                packed, axis=0, return_index=True, return_inverse=True
+            )
+
+        n_pat = len(first)
+        self.inverse = inverse.ravel()
+        self.observed = ~mask[first]
+        self.counts = np.bincount(self.inverse, minlength=n_pat)
+
+        # accumulate on data shifted by the column means of the first chunk, for numerical stability
+        head = self.values[:chunk_size]
+        head_observed = ~np.isnan(head)
+        self.shift = np.where(head_observed, head, 0).sum(axis=0) / np.maximum(head_observed.sum(axis=0), 1)
+
+        self.shifted_sums = np.zeros((n_pat, self.n_var))
+        self.shifted_cross = np.zeros((self.n_var, self.n_var))
+        for start in range(0, n, chunk_size):
+            chunk = self.values[start : start + chunk_size] - self.shift
+            chunk[np.isnan(chunk)] = 0
+            indicator = csr_matrix(
+                (np.ones(len(chunk)), (self.inverse[start : start + chunk_size], np.arange(len(chunk)))),
+                shape=(n_pat, len(chunk)),
+            )
+            self.shifted_sums += indicator @ chunk
+            self.shifted_cross += chunk.T @ chunk
+        self.sums = self.shifted_sums + self.counts[:, None] * self.observed * self.shift
+
+    def pairwise_mean_cov(self):
+        """Column means and pairwise-complete covariance, matching :meth:`pandas.DataFrame.mean` and ``cov``"""
+        observed = self.observed.astype(float)
+        mean = self.sums.sum(axis=0) / (self.counts @ observed)
+
+        # counts and sums over the rows where both features of a pair are observed
+        n_pair = observed.T @ (self.counts[:, None] * observed)
+        sum_pair = self.shifted_sums.T @ observed
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = (self.shifted_cross - sum_pair * sum_pair.T / n_pair) / (n_pair - 1)
+        return mean, cov
+
+    def little_statistic(self, mean: np.ndarray, cov: np.ndarray, block_size: int = 10_000_000):
+        r"""
+        Little's :math:`d^2` statistic and the number of observed (pattern, feature) cells.
+
+        The inverse of each observed block of ``cov`` is never formed per pattern. With :math:`P` the inverse
+        of the full covariance, :math:`\Sigma_{oo}^{-1} = P_{oo} - P_{om} P_{mm}^{-1} P_{mo}`, so only the small
+        missing-by-missing systems are solved, batched over all patterns with the same number of missing features.
+        """
+        diffs = np.where(self.observed, self.sums / np.maximum(self.counts, 1)[:, None] - mean, 0)
+        pj = self.observed.sum()
+
+        try:
+            precision = cho_solve(cho_factor(cov), np.identity(self.n_var))
+        except np.linalg.LinAlgError:
+            # e.g. a pairwise covariance that is not positive definite: solve per pattern
+            d2 = 0
+            for observed, count, means in zip(self.observed, self.counts, diffs):
+                if observed.any():
+                    select_cov = cov[np.ix_(observed, observed)]
+                    d2 += count * np.dot(means[observed], np.linalg.solve(select_cov, means[observed]))
+            return d2, pj
+
+        projected = diffs @ precision
+        quad = np.sum(diffs * projected, axis=1)
+        n_missing = self.n_var - self.observed.sum(axis=1)
+        for k in np.unique(n_missing[n_missing > 0]):
+            rows = np.flatnonzero(n_missing == k)
+            for start in range(0, len(rows), max(1, block_size // (k * k))):
+                block = rows[start : start + max(1, block_size // (k * k))]
+                missing = np.nonzero(~self.observed[block])[1].reshape(len(block), k)
+                v = projected[block[:, None], missing]
+                p_mm = precision[missing[:, :, None], missing[:, None, :]]
+                quad[block] -= np.sum(v * np.linalg.solve(p_mm, v[..., None])[..., 0], axis=1)
+
+        return self.counts @ quad, pj
+
+    def pattern_cross(self) -> np.ndarray:
+        """Per-pattern cross-products of the shifted data, zero outside the observed features (computed once)"""
+        if not hasattr(self, "_pattern_cross"):
+            order = np.argsort(self.inverse, kind="stable")
+            bounds = np.concatenate([[0], np.cumsum(self.counts)])
+            self._pattern_cross = np.zeros((len(self.counts), self.n_var, self.n_var))
+            for p, observed in enumerate(self.observed):
+                block = self.values[order[bounds[p] : bounds[p + 1]]][:, observed] - self.shift[observed]
+                self._pattern_cross[p][np.ix_(observed, observed)] = block.T @ block
+        return self._pattern_cross
+
+    def em_mean_cov(self, tol: float = 1e-4, max_iter: int = 100, init: tuple = None, block_size: int = 2_000_000):
+        """EM estimates of the mean and covariance, see :meth:`MCARTest.em_mean_cov`"""
+        n = self.counts.sum()
+        cross = self.pattern_cross()
+        n_missing = self.n_var - self.observed.sum(axis=1)
+        complete = n_missing == 0
+
+        if init is None:
+            mean, cov = self.pairwise_mean_cov()
+            cov = np.diag(np.diag(cov))
+        else:
+            mean, cov = (np.asarray(a, dtype=float) for a in init)
+        mean = mean - self.shift
+
+        for n_iter in range(max_iter):
+            precision = cho_solve(cho_factor(cov), np.identity(self.n_var))
+            sum_x = self.shifted_sums[complete].sum(axis=0)
+            sum_xx = cross[complete].sum(axis=0)
+
+            # E-step, batched over the patterns with the same number of missing features.
+            # With P the inverse covariance, the regression of the missing on the observed features
+            # is -P_mm^-1 P_mo and the conditional covariance of the missing features is P_mm^-1.
+            for k in np.unique(n_missing[~complete]):
+                rows = np.flatnonzero(n_missing == k)
+                step = max(1, block_size // self.n_var**2)
+                for start in range(0, len(rows), step):
+                    block = rows[start : start + step]
+                    g = np.arange(len(block))
+                    missing = np.nonzero(~self.observed[block])[1].reshape(len(block), k)
+                    observed = np.nonzero(self.observed[block])[1].reshape(len(block), self.n_var - k)
+
+                    p_mm = precision[missing[:, :, None], missing[:, None, :]]
+                    p_mo = precision[missing[:, :, None], observed[:, None, :]]
+                    cond_cov = np.linalg.inv(p_mm)
+                    coef = -cond_cov @ p_mo
+                    offset = mean[missing] - (coef @ mean[observed][..., None])[..., 0]
+
+                    # E[x | x_o] = A x + c, with x zero-filled and A the identity on the observed features
+                    A = np.zeros((len(block), self.n_var, self.n_var))
+                    A[g[:, None], observed, observed] = 1
+                    A[g[:, None, None], missing[:, :, None], observed[:, None, :]] = coef
+                    c = np.zeros((len(block), self.n_var))
+                    c[g[:, None], missing] = offset
+                    V = np.zeros((len(block), self.n_var, self.n_var))
+                    V[g[:, None, None], missing[:, :, None], missing[:, None, :]] = cond_cov
+
+                    counts = self.counts[block]
+                    As = (A @ self.shifted_sums[block][..., None])[..., 0]
+                    Asc = As[:, :, None] * c[:, None, :]
+                    sum_x += As.sum(axis=0) + counts @ c
+                    sum_xx += (A @ cross[block] @ A.transpose(0, 2, 1)).sum(axis=0)
+                    sum_xx += (Asc + Asc.transpose(0, 2, 1)).sum(axis=0)
+                    sum_xx += np.einsum("g,gij->ij", counts, c[:, :, None] * c[:, None, :] + V)
+
+            # M-step
+            new_mean = sum_x / n
+            new_cov = sum_xx / n - np.outer(new_mean, new_mean)
+
+            scale = np.sqrt(np.diag(new_cov))
+            change = max(
+                np.max(np.abs(new_mean - mean) / scale),
+                np.max(np.abs(new_cov - cov) / np.outer(scale, scale)),
+            )
+            mean, cov = new_mean, new_cov
+            if change < tol:
+                break
+        else:
+            warning(f"EM estimation did not converge in {max_iter} iterations.")
+
+        return mean + self.shift, cov
@@ -1,5 +1,7 @@
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.stats import beta
 
 def calculate_moc_c(df: pd.DataFrame, column_name: str) -> float:
     """
@@ -33,6 +35,249 @@ def calculate_moc_c(df: pd.DataFrame, column_name: str) -> float:
 
     return moc_c, std_dev_mean
 
+
+def _as_columns(group_columns):
+    if isinstance(group_columns, str):
+        return [group_columns]
+    return list(group_columns or [])
+
+
+def _sorted_groups(df, group_columns, order_columns, value_columns):
+    """Sort the rows with complete values by group, return them with each group's start row, size and the row group codes"""
+    for column in group_columns + order_columns + value_columns:
+        if column not in df.columns:
+            raise ValueError(f"Column '{column}' not found in DataFrame.")
+
+    data = df.loc[df[value_columns].notna().all(axis=1), group_columns + order_columns + value_columns]
+    data = data.sort_values(group_columns + order_columns, kind='stable').reset_index(drop=True)
+    n = len(data)
+
+    # Group boundaries in the sorted table
+    if group_columns and n:
+        keys = data[group_columns].to_numpy()
+        new_group = np.ones(n, dtype=bool)
+        new_group[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    else:
+        new_group = np.zeros(n, dtype=bool)
+        new_group[:1] = True
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, n))
+    codes = np.cumsum(new_group) - 1
+    return data, starts, counts, codes
+
+
+MOC_WINDOW_MODES = ('full', 'rolling', 'expanding')
+
+
+def calculate_moc_c_batch(df: pd.DataFrame, column_name: str, group_columns=None, year_column: str = 'Year',
+                          mode: str = 'full', window: int = None, min_periods: int = None) -> pd.DataFrame:
+    """
+    Calculate MoC C and the standard deviation of the mean for every group and calibration window.
+
+    The long table is sorted once by group and year, and every window statistic is taken
+    from differences of cumulative sums, so all groups and windows come out of one
+    vectorised pass without a groupby. Rows with a missing default rate are dropped.
+    Windows are measured in calendar years of `year_column`, so gaps in the years shorten
+    a rolling window, and several rows in one year all fall in the same windows.
+
+    Parameters:
+    df (pd.DataFrame): Long table with (usually) one row per group and year.
+    column_name (str): The name of the column containing the annual default rates.
+    group_columns (str or list): Columns identifying a group (e.g. rating grade, segment, model).
+        None treats the whole table as one group.
+    year_column (str): The name of the column with the year, used to order the observations.
+    mode (str): 'full' for one window over all years of a group, 'rolling' for windows of the last
+        `window` years ending at every year, 'expanding' for windows from the first year of the group.
+    window (int): Number of calendar years per window in 'rolling' mode, e.g. 5 for 2016-2020.
+    min_periods (int): Minimum number of distinct years with data in a window; defaults to `window`
+        for 'rolling' and 1 otherwise.
+
+    Returns:
+    pd.DataFrame: One row per group and window with the group columns, Start_Year, End_Year, N_Years
+        (distinct years), N_Obs (rows), Mean_Default_Rate, Std_Dev_Mean and MoC_C, matching
+        calculate_moc_c on the rows of the same years.
+
+    Example:
+    >>> df = pd.DataFrame({'Grade': ['A'] * 6 + ['B'] * 6, 'Year': list(range(2010, 2016)) * 2,
+                           'Default_Rate': [0.05, 0.04, 0.06, 0.03, 0.07, 0.05, 0.1, 0.12, 0.09, 0.11, 0.1, 0.13]})
+    >>> calculate_moc_c_batch(df, 'Default_Rate', 'Grade', mode='rolling', window=3)
+    """
+    group_columns = _as_columns(group_columns)
+
+    # Validate the window options
+    if mode not in MOC_WINDOW_MODES:
+        raise ValueError(f"Mode '{mode}' is not supported, use one of {MOC_WINDOW_MODES}")
+    if mode == 'rolling' and (window is None or window < 1):
+        raise ValueError("A positive window is required for mode 'rolling'")
+    if min_periods is None:
+        min_periods = window if mode == 'rolling' else 1
+
+    data, starts, counts, codes = _sorted_groups(df, group_columns, [year_column], [column_name])
+    x = data[column_name].to_numpy(dtype=float)
+    n = len(x)
+
+    # Cumulative sums of the values centred on their group mean, which keeps the variance accurate
+    group_mean = np.add.reduceat(x, starts) / counts if n else np.zeros(0)
+    centred = x - group_mean[codes]
+    c1 = np.concatenate([[0.0], np.cumsum(centred)])
+    c2 = np.concatenate([[0.0], np.cumsum(centred ** 2)])
+
+    # Running count of distinct (group, year) pairs, so windows are measured in years, not rows
+    years = data[year_column].to_numpy()
+    new_year = np.ones(n, dtype=bool)
+    new_year[1:] = (codes[1:] != codes[:-1]) | (years[1:] != years[:-1])
+    year_count = np.concatenate([[0], np.cumsum(new_year)])
+
+    # Windows as [begin, end) row ranges, ending after the last row of a year
+    if mode == 'full':
+        begin, end = starts, starts + counts
+    else:
+        end = np.flatnonzero(np.append(new_year[1:], n > 0)) + 1
+        if mode == 'expanding':
+            begin = starts[codes[end - 1]]
+        else:
+            # Years spaced so that groups are more than a window apart, then the first row
+            # of each window is the first one within `window` years of its last year
+            key = years + codes * ((np.ptp(years) if n else 0) + window + 1)
+            begin = np.searchsorted(key, key[end - 1] - window, side='right')
+    n_years = year_count[end] - year_count[begin]
+    keep = n_years >= max(min_periods, 1)
+    begin, end, n_years = begin[keep], end[keep], n_years[keep]
+    size = end - begin
+    last = end - 1
+
+    mean_centred = (c1[end] - c1[begin]) / size
+    variance = np.maximum((c2[end] - c2[begin]) / size - mean_centred ** 2, 0.0)
+    variance[size == 1] = 0.0
+    avg_default_rate = mean_centred + group_mean[codes[last]]
+    std_dev_mean = np.sqrt(variance) / np.sqrt(size)
+
+    result = data.loc[last, group_columns].reset_index(drop=True)
+    result['Start_Year'] = data[year_column].to_numpy()[begin]
+    result['End_Year'] = data[year_column].to_numpy()[last]
+    result['N_Years'] = n_years
+    result['N_Obs'] = size
+    result['Mean_Default_Rate'] = avg_default_rate
+    result['Std_Dev_Mean'] = std_dev_mean
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['MoC_C'] = std_dev_mean / avg_default_rate
+    return result
+
+
+def _bootstrap_means(x, counts, n_boot, seed_seq):
+    """Means of n_boot resamples (with replacement) of each consecutive group of x, shape (n_boot, groups)"""
+    rng = np.random.default_rng(seed_seq)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    row_group = np.repeat(np.arange(len(counts)), counts)
+    draws = offsets[row_group] + (rng.random((n_boot, len(x))) * counts[row_group]).astype(np.intp)
+    return np.add.reduceat(x[draws], offsets, axis=1) / counts
+
+
+def calculate_moc_bootstrap(df: pd.DataFrame, column_name: str, group_columns=None, n_boot: int = 1000,
+                            confidence_level: float = 0.9, seed: int = 0, n_jobs: int = 1,
+                            chunk_size: int = 256) -> pd.DataFrame:
+    """
+    Calculate bootstrap MoC bands on the long-run average default rate of every group.
+
+    The annual default rates of each group are resampled with replacement n_boot times.
+    Groups are processed in chunks of `chunk_size`, each resampled in one vectorised draw and,
+    with n_jobs > 1, spread over a thread pool. Every chunk gets its own seed spawned from `seed`,
+    so reruns with the same seed and chunk_size reproduce exactly, whatever n_jobs is.
+
+    Parameters:
+    df (pd.DataFrame): Long table with (usually) one row per group and year.
+    column_name (str): The name of the column containing the annual default rates.
+    group_columns (str or list): Columns identifying a group. None treats the whole table as one group.
+    n_boot (int): Number of bootstrap resamples.
+    confidence_level (float): Quantile of the bootstrap distribution used as the upper band.
+    seed (int): Seed of the resampling.
+    n_jobs (int): Number of threads (-1 for all cores).
+    chunk_size (int): Number of groups resampled together.
+
+    Returns:
+    pd.DataFrame: One row per group with N_Years, Mean_Default_Rate, Bootstrap_Std (standard deviation
+        of the resampled means), MoC_C_Bootstrap (Bootstrap_Std / Mean_Default_Rate), Bootstrap_Upper
+        and MoC_Bootstrap ((Bootstrap_Upper - Mean_Default_Rate) / Mean_Default_Rate).
+    """
+    group_columns = _as_columns(group_columns)
+    data, starts, counts, _ = _sorted_groups(df, group_columns, [], [column_name])
+    x = data[column_name].to_numpy(dtype=float)
+
+    chunks = [(starts[i], starts[i:i + chunk_size], counts[i:i + chunk_size])
+              for i in range(0, len(starts), chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+
+    def run(chunk, seed_seq):
+        first, chunk_starts, chunk_counts = chunk
+        means = _bootstrap_means(x[first:first + chunk_counts.sum()], chunk_counts, n_boot, seed_seq)
+        return means.std(axis=0, ddof=1), np.quantile(means, confidence_level, axis=0)
+
+    if n_jobs == 1:
+        stats = list(map(run, chunks, seeds))
+    else:
+        with ThreadPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs) as pool:
+            stats = list(pool.map(run, chunks, seeds))
+
+    avg_default_rate = np.add.reduceat(x, starts) / counts if len(x) else np.zeros(0)
+    bootstrap_std = np.concatenate([std for std, _ in stats]) if stats else np.zeros(0)
+    bootstrap_upper = np.concatenate([upper for _, upper in stats]) if stats else np.zeros(0)
+
+    result = data.loc[starts, group_columns].reset_index(drop=True)
+    result['N_Years'] = counts
+    result['Mean_Default_Rate'] = avg_default_rate
+    result['Bootstrap_Std'] = bootstrap_std
+    result['Bootstrap_Upper'] = bootstrap_upper
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['MoC_C_Bootstrap'] = bootstrap_std / avg_default_rate
+        result['MoC_Bootstrap'] = (bootstrap_upper - avg_default_rate) / avg_default_rate
+    return result
+
+
+def calculate_moc_jeffreys(df: pd.DataFrame, defaults_column: str, obligors_column: str, group_columns=None,
+                           confidence_level: float = 0.9) -> pd.DataFrame:
+    """
+    Calculate Jeffreys MoC bands on the pooled default rate of every group.
+
+    Defaults and obligors are pooled over the rows of each group and the upper band is the
+    `confidence_level` quantile of the Jeffreys posterior Beta(D + 0.5, N - D + 0.5), evaluated
+    for all groups in one call. The additive add-on stays finite for groups without defaults.
+
+    Parameters:
+    df (pd.DataFrame): Long table, e.g. one row per group and year.
+    defaults_column (str): The name of the column with the number of defaults.
+    obligors_column (str): The name of the column with the number of obligors.
+    group_columns (str or list): Columns identifying a group. None treats the whole table as one group.
+    confidence_level (float): Quantile of the posterior used as the upper band.
+
+    Returns:
+    pd.DataFrame: One row per group with Defaults, Obligors, Default_Rate, Jeffreys_Upper,
+        Jeffreys_Add_On (Jeffreys_Upper - Default_Rate) and MoC_Jeffreys (Jeffreys_Add_On / Default_Rate).
+    """
+    group_columns = _as_columns(group_columns)
+    data, starts, counts, _ = _sorted_groups(df, group_columns, [], [defaults_column, obligors_column])
+    if len(data):
+        defaults = np.add.reduceat(data[defaults_column].to_numpy(dtype=float), starts)
+        obligors = np.add.reduceat(data[obligors_column].to_numpy(dtype=float), starts)
+    else:
+        defaults = obligors = np.zeros(0)
+    if (defaults > obligors).any():
+        raise ValueError("Number of defaults exceeds the number of obligors.")
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        default_rate = defaults / obligors
+        upper = beta.ppf(confidence_level, defaults + 0.5, obligors - defaults + 0.5)
+
+    result = data.loc[starts, group_columns].reset_index(drop=True)
+    result['Defaults'] = defaults
+    result['Obligors'] = obligors
+    result['Default_Rate'] = default_rate
+    result['Jeffreys_Upper'] = upper
+    result['Jeffreys_Add_On'] = upper - default_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['MoC_Jeffreys'] = result['Jeffreys_Add_On'] / default_rate
+    return result
+
+
 # Example usage
 df = pd.DataFrame({
     'Year': [2010, 2011, 2012, 2013, 2014, 2015],
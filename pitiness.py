@@ -0,0 +1,409 @@
+"""
+PITiness assessment methods for IRB PD models.
+
+Functions packaged from the pitiness_methods notebook, which score one pair of
+model PD / observed DR series at a time, and `pitiness_matrix`, which computes
+every metric for a whole (series x years) matrix with array operations.
+
+Values closer to 1 indicate PIT behaviour, values closer to 0 TTC behaviour.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.optimize import minimize_scalar
+
+
+def generate_pd_dr_series(n_years=15, base_dr=0.02, volatility=0.3, pitiness=0.7, seed=None):
+    """
+    Generate correlated PD and DR time series with controlled PITiness.
+
+    Parameters:
+    -----------
+    n_years : int - Number of annual observations
+    base_dr : float - Long-run average default rate
+    volatility : float - Volatility of default rates
+    pitiness : float - True PITiness (0=TTC, 1=PIT)
+
+    Returns:
+    --------
+    tuple: (actual_dr, model_pd) arrays
+    """
+    if seed:
+        np.random.seed(seed)
+
+    # Generate economic cycle (systematic factor Z)
+    z_factor = np.zeros(n_years)
+    z_factor[0] = np.random.normal(0, 1)
+    for t in range(1, n_years):
+        z_factor[t] = 0.7 * z_factor[t-1] + np.random.normal(0, 0.7)  # AR(1) process
+
+    # Generate actual default rates using Vasicek framework
+    rho = 0.15  # Asset correlation
+    k = stats.norm.ppf(base_dr)
+
+    actual_dr = np.zeros(n_years)
+    for t in range(n_years):
+        # PIT default rate from Vasicek
+        threshold = (k - np.sqrt(rho) * z_factor[t]) / np.sqrt(1 - rho)
+        actual_dr[t] = stats.norm.cdf(threshold)
+        # Add idiosyncratic noise
+        actual_dr[t] *= (1 + np.random.normal(0, 0.1))
+
+    actual_dr = np.clip(actual_dr, 0.001, 0.30)  # Bound DRs
+
+    # Generate model PDs based on PITiness
+    ttc_pd = base_dr * np.ones(n_years)  # Pure TTC = constant
+    pit_pd = actual_dr.copy()  # Pure PIT = tracks DR
+
+    # Hybrid: blend based on pitiness parameter
+    model_pd = pitiness * pit_pd + (1 - pitiness) * ttc_pd
+    model_pd += np.random.normal(0, 0.002, n_years)  # Add noise
+    model_pd = np.clip(model_pd, 0.001, 0.30)
+
+    return actual_dr, model_pd, z_factor
+
+
+def pra_cyclicality(model_pd, actual_dr):
+    """
+    PRA Cyclicality Formula from SS11/13.
+
+    Measures the proportion of default rate changes explained by PD changes.
+
+    Returns: Cyclicality percentage (0-100%, higher = more PIT)
+    """
+    pd_changes = np.abs(np.diff(model_pd))
+    dr_changes = np.abs(np.diff(actual_dr))
+
+    # Avoid division by zero
+    if np.sum(dr_changes) < 1e-10:
+        return np.nan
+
+    cyclicality = np.sum(pd_changes) / np.sum(dr_changes)
+    return min(cyclicality, 1.0)  # Cap at 100%
+
+
+def correlation_pitiness(model_pd, actual_dr):
+    """
+    Correlation-based PITiness measure.
+
+    Returns: Correlation coefficient (0-1, higher = more PIT)
+    """
+    corr, _ = stats.pearsonr(model_pd, actual_dr)
+    return max(0, corr)  # Floor at 0 for interpretability
+
+
+def variance_ratio_pitiness(model_pd, actual_dr):
+    """
+    Variance ratio PITiness measure.
+
+    Returns: Variance ratio (0-1+, values near 1 indicate PIT)
+    """
+    var_pd = np.var(model_pd)
+    var_dr = np.var(actual_dr)
+
+    if var_dr < 1e-10:
+        return np.nan
+
+    ratio = var_pd / var_dr
+    return min(ratio, 1.0)  # Cap at 1
+
+
+def regression_beta_pitiness(model_pd, actual_dr):
+    """
+    Regression-based PITiness (beta coefficient).
+
+    Returns: Beta coefficient (0-1, higher = more PIT)
+    """
+    slope, intercept, r_value, p_value, std_err = stats.linregress(actual_dr, model_pd)
+    return max(0, min(slope, 1.0))  # Bound between 0 and 1
+
+
+def carlehed_petrov_lambda(model_pd, actual_dr, rho=0.15):
+    """
+    Carlehed-Petrov PITness parameter (λ) estimation.
+
+    Uses optimization to find λ that best explains the model PD behavior.
+
+    Parameters:
+    -----------
+    model_pd : array - Model PD estimates
+    actual_dr : array - Observed default rates
+    rho : float - Asset correlation parameter (default 0.15)
+
+    Returns: λ (0-1, higher = more PIT)
+    """
+    # Estimate TTC PD as long-run average
+    pd_ttc = np.mean(actual_dr)
+    k = stats.norm.ppf(pd_ttc)
+
+    # Extract Z factors from observed DRs
+    dr = np.clip(actual_dr, 0.0001, 0.9999)
+    z_factors = (k - np.sqrt(1 - rho) * stats.norm.ppf(dr)) / np.sqrt(rho)
+
+    def objective(lambda_param):
+        """Minimize squared error between model and theoretical hybrid PD"""
+        denom = max(np.sqrt(1 - lambda_param**2 * rho), 0.01)
+        hybrid_pd = stats.norm.cdf((k - lambda_param * np.sqrt(rho) * z_factors) / denom)
+        return np.sum((model_pd - hybrid_pd)**2)
+
+    # Optimize λ
+    result = minimize_scalar(objective, bounds=(0, 1), method='bounded')
+    return result.x
+
+
+def zscore_volatility_ratio(model_pd, actual_dr):
+    """
+    Z-score volatility ratio PITiness measure.
+
+    Compares volatility in normal (probit) space.
+
+    Returns: Volatility ratio (0-1, higher = more PIT)
+    """
+    # Transform to normal space (probit)
+    pd_clipped = np.clip(model_pd, 0.0001, 0.9999)
+    dr_clipped = np.clip(actual_dr, 0.0001, 0.9999)
+
+    z_pd = stats.norm.ppf(pd_clipped)
+    z_dr = stats.norm.ppf(dr_clipped)
+
+    std_z_pd = np.std(z_pd)
+    std_z_dr = np.std(z_dr)
+
+    if std_z_dr < 1e-10:
+        return np.nan
+
+    ratio = std_z_pd / std_z_dr
+    return min(ratio, 1.0)
+
+
+def first_diff_correlation(model_pd, actual_dr):
+    """
+    First-difference correlation PITiness.
+
+    Measures co-movement of changes rather than levels.
+
+    Returns: Correlation of changes (0-1, higher = more PIT)
+    """
+    pd_diff = np.diff(model_pd)
+    dr_diff = np.diff(actual_dr)
+
+    if len(pd_diff) < 3:
+        return np.nan
+
+    corr, _ = stats.pearsonr(pd_diff, dr_diff)
+    return max(0, corr)
+
+
+def r_squared_pitiness(model_pd, actual_dr):
+    """
+    R-squared from regressing DR on model PD.
+
+    Returns: R² (0-1, higher = more PIT)
+    """
+    slope, intercept, r_value, p_value, std_err = stats.linregress(model_pd, actual_dr)
+    return r_value**2
+
+
+def calculate_all_pitiness_metrics(model_pd_series, actual_dr_series, rho=0.15):
+    """
+    Calculate all PITiness metrics for a single portfolio.
+
+    Parameters:
+    -----------
+    model_pd_series : array-like - Time series of model PD estimates
+    actual_dr_series : array-like - Time series of observed default rates
+    rho : float - Asset correlation for Carlehed-Petrov method
+
+    Returns:
+    --------
+    dict : Dictionary of PITiness metrics
+    """
+    model_pd = np.array(model_pd_series)
+    actual_dr = np.array(actual_dr_series)
+
+    results = {
+        'PRA_Cyclicality': pra_cyclicality(model_pd, actual_dr),
+        'Correlation': correlation_pitiness(model_pd, actual_dr),
+        'Variance_Ratio': variance_ratio_pitiness(model_pd, actual_dr),
+        'Regression_Beta': regression_beta_pitiness(model_pd, actual_dr),
+        'Carlehed_Petrov_λ': carlehed_petrov_lambda(model_pd, actual_dr, rho),
+        'ZScore_Vol_Ratio': zscore_volatility_ratio(model_pd, actual_dr),
+        'FirstDiff_Corr': first_diff_correlation(model_pd, actual_dr),
+        'R_Squared': r_squared_pitiness(model_pd, actual_dr),
+    }
+
+    return results
+
+
+def _rowwise_corr(a, b):
+    # Pearson correlation of every row of a with the same row of b
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+
+
+def _floor_zero(x):
+    # Same as max(0, x) element-wise, including NaN -> 0
+    return np.where(x > 0, x, 0.0)
+
+
+def carlehed_petrov_lambdas(model_pd, actual_dr, rho=0.15, grid_size=51, tol=1e-10):
+    """
+    Carlehed-Petrov λ for every row of (series x years) arrays.
+
+    The squared-error objective of `carlehed_petrov_lambda` is evaluated for all series on a
+    grid of λ in [0, 1]; the minimum is then refined by bisection on the analytical derivative
+    within the bracket around the best grid point, all series at once. λ stays at a bound when
+    the objective is increasing (at 0) or decreasing (at 1) there.
+
+    Parameters:
+    -----------
+    model_pd : array (series x years) - Model PD estimates
+    actual_dr : array (series x years) - Observed default rates
+    rho : float - Asset correlation parameter (default 0.15)
+    grid_size : int - Number of λ grid points used to bracket the minimum
+    tol : float - Width of the final bracket
+
+    Returns: array of λ per series
+    """
+    model_pd = np.atleast_2d(np.asarray(model_pd, dtype=float))
+    actual_dr = np.atleast_2d(np.asarray(actual_dr, dtype=float))
+
+    k = stats.norm.ppf(actual_dr.mean(axis=1, keepdims=True))
+    sqrt_rho = np.sqrt(rho)
+    z = (k - np.sqrt(1 - rho) * stats.norm.ppf(np.clip(actual_dr, 0.0001, 0.9999))) / sqrt_rho
+
+    def hybrid(lam):
+        # lam broadcasts against (series, years); returns the probit argument and its denominator
+        s = np.maximum(np.sqrt(1 - lam ** 2 * rho), 0.01)
+        return (k - lam * sqrt_rho * z) / s, s
+
+    def derivative(lam):
+        h, s = hybrid(lam)
+        dh = (-sqrt_rho * z * s + (k - lam * sqrt_rho * z) * lam * rho / s) / s ** 2
+        return (-2 * (model_pd - stats.norm.cdf(h)) * stats.norm.pdf(h) * dh).sum(axis=1)
+
+    # Grid search, series x grid x years
+    grid = np.linspace(0, 1, grid_size)
+    s = np.maximum(np.sqrt(1 - grid ** 2 * rho), 0.01)[None, :, None]
+    h = (k[:, :, None] - grid[None, :, None] * sqrt_rho * z[:, None, :]) / s
+    objective = ((model_pd[:, None, :] - stats.norm.cdf(h)) ** 2).sum(axis=2)
+    best = np.nanargmin(np.where(np.isnan(objective), np.inf, objective), axis=1)
+
+    lo = grid[np.maximum(best - 1, 0)][:, None]
+    hi = grid[np.minimum(best + 1, grid_size - 1)][:, None]
+
+    # Bisection on the derivative: keep a bracket with derivative <= 0 at lo and >= 0 at hi
+    d_lo, d_hi = derivative(lo), derivative(hi)
+    at_lo = d_lo >= 0
+    at_hi = d_hi <= 0
+    for _ in range(int(np.ceil(np.log2(2.0 / (grid_size - 1) / tol)))):
+        mid = 0.5 * (lo + hi)
+        d_mid = derivative(mid)
+        lo = np.where((d_mid <= 0)[:, None], mid, lo)
+        hi = np.where((d_mid > 0)[:, None], mid, hi)
+
+    lam = 0.5 * (lo + hi)[:, 0]
+    # Monotone objective inside the bracket: the minimum sits on its edge
+    lam = np.where(at_lo & ~at_hi, grid[np.maximum(best - 1, 0)], lam)
+    lam = np.where(at_hi & ~at_lo, grid[np.minimum(best + 1, grid_size - 1)], lam)
+    return lam
+
+
+# Row-wise versions of the methods above, each taking (series x years) matrices and
+# returning one value per series; rho is only used by the Carlehed-Petrov λ
+def _pra_cyclicality_rows(model_pd, actual_dr, rho):
+    dr_changes = np.abs(np.diff(actual_dr, axis=1)).sum(axis=1)
+    cyclicality = np.abs(np.diff(model_pd, axis=1)).sum(axis=1) / dr_changes
+    return np.where(dr_changes < 1e-10, np.nan, np.minimum(cyclicality, 1.0))
+
+
+def _correlation_rows(model_pd, actual_dr, rho):
+    return _floor_zero(_rowwise_corr(model_pd, actual_dr))
+
+
+def _variance_ratio_rows(model_pd, actual_dr, rho):
+    var_dr = actual_dr.var(axis=1)
+    return np.where(var_dr < 1e-10, np.nan, np.minimum(model_pd.var(axis=1) / var_dr, 1.0))
+
+
+def _regression_beta_rows(model_pd, actual_dr, rho):
+    cov = ((model_pd - model_pd.mean(axis=1, keepdims=True))
+           * (actual_dr - actual_dr.mean(axis=1, keepdims=True))).mean(axis=1)
+    # Like stats.linregress, undefined when all x values are identical
+    slope = np.where(np.ptp(actual_dr, axis=1) > 0, cov / actual_dr.var(axis=1), np.nan)
+    return np.where(np.isnan(slope), np.nan, _floor_zero(np.minimum(slope, 1.0)))
+
+
+def _zscore_volatility_ratio_rows(model_pd, actual_dr, rho):
+    std_z_pd = stats.norm.ppf(np.clip(model_pd, 0.0001, 0.9999)).std(axis=1)
+    std_z_dr = stats.norm.ppf(np.clip(actual_dr, 0.0001, 0.9999)).std(axis=1)
+    return np.where(std_z_dr < 1e-10, np.nan, np.minimum(std_z_pd / std_z_dr, 1.0))
+
+
+def _first_diff_correlation_rows(model_pd, actual_dr, rho):
+    if model_pd.shape[1] - 1 < 3:
+        return np.full(len(model_pd), np.nan)
+    return _floor_zero(_rowwise_corr(np.diff(model_pd, axis=1), np.diff(actual_dr, axis=1)))
+
+
+def _r_squared_rows(model_pd, actual_dr, rho):
+    # Undefined when the model PD is constant
+    return np.where(np.ptp(model_pd, axis=1) > 0, _rowwise_corr(model_pd, actual_dr) ** 2, np.nan)
+
+
+METHODS = {
+    'PRA_Cyclicality': _pra_cyclicality_rows,
+    'Correlation': _correlation_rows,
+    'Variance_Ratio': _variance_ratio_rows,
+    'Regression_Beta': _regression_beta_rows,
+    'Carlehed_Petrov_λ': carlehed_petrov_lambdas,
+    'ZScore_Vol_Ratio': _zscore_volatility_ratio_rows,
+    'FirstDiff_Corr': _first_diff_correlation_rows,
+    'R_Squared': _r_squared_rows,
+}
+
+
+def pitiness_matrix(model_pd, actual_dr, rho=0.15, methods=None):
+    """
+    Calculate PITiness metrics for many series at once.
+
+    Parameters:
+    -----------
+    model_pd : array or DataFrame (series x years) - Model PD estimates, one row per series
+    actual_dr : array or DataFrame (series x years) - Observed default rates, aligned with model_pd
+    rho : float - Asset correlation for Carlehed-Petrov method
+    methods : list of str - Names of the METHODS to compute, all of them by default
+
+    Returns:
+    --------
+    DataFrame : One row per series and one column per method, as calculate_all_pitiness_metrics
+    """
+    index = model_pd.index if isinstance(model_pd, pd.DataFrame) else None
+    model_pd = np.atleast_2d(np.asarray(model_pd, dtype=float))
+    actual_dr = np.atleast_2d(np.asarray(actual_dr, dtype=float))
+    if model_pd.shape != actual_dr.shape:
+        raise ValueError(f"Shapes of model_pd {model_pd.shape} and actual_dr {actual_dr.shape} do not match")
+    methods = list(METHODS) if methods is None else methods
+    unknown = [name for name in methods if name not in METHODS]
+    if unknown:
+        raise ValueError(f"Unknown PITiness methods {unknown}, use names from {list(METHODS)}")
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        results = {name: METHODS[name](model_pd, actual_dr, rho) for name in methods}
+    return pd.DataFrame(results, index=index)
+
+
+if __name__ == "__main__":
+    # Simulated rating grades with PITiness spread over [0, 1]
+    years = list(range(2010, 2025))
+    true_pitiness = np.linspace(0.05, 0.95, 200)
+    series = [generate_pd_dr_series(n_years=len(years), base_dr=0.03, pitiness=p, seed=i + 1)
+              for i, p in enumerate(true_pitiness)]
+    actual_dr = pd.DataFrame([dr for dr, _, _ in series], columns=years)
+    model_pd = pd.DataFrame([pd_ for _, pd_, _ in series], columns=years)
+
+    results_df = pitiness_matrix(model_pd, actual_dr)
+    results_df.insert(0, 'True_PITiness', true_pitiness)
+    print(results_df.corr()['True_PITiness'])
@@ -0,0 +1,380 @@
+"""
+Basel IRB risk-weighted assets.
+
+`calculate_RWA` is the scalar function of the rwa_calculations notebook (BCBS 128).
+`calculate_RWA_batch` computes the correlation, maturity adjustment and capital K of
+whole arrays of exposures from all classes in one pass, selecting the class formulas
+with per-class masks instead of branching per exposure. `RWAScenarios` keeps the
+terms that do not depend on the shocks and evaluates grids of PD / LGD scenarios.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.special import ndtr, ndtri
+from scipy.stats import norm
+
+EXPOSURE_CLASSES = (
+    "Corporate Exposures",
+    "Residential Mortgages",
+    "Qualifying Revolving Retail Exposures",
+    "Other Retail Exposures",
+)
+CORPORATE, MORTGAGE, QRRE, OTHER_RETAIL = range(len(EXPOSURE_CLASSES))
+
+# PDs are kept inside (0, 1) where they enter the inverse normal and the log of b(PD)
+PD_CLIP = 1e-9
+G_999 = ndtri(0.999)
+
+
+def calculate_RWA(exposure_type, PD, LGD, EAD, add_on=1.06, M=None, S=None):
+    """
+    Calculate Risk-Weighted Assets (RWA) for different types of exposures.
+
+    Parameters:
+    - exposure_type (str): Type of regulatory exposure class.
+    - PD (float): Probability of Default. Must be between 0 and 1.
+    - LGD (float): Loss Given Default. Must be between 0 and 1.
+    - EAD (float): Exposure at Default.
+    - M (float, optional): Maturity for corporate exposures. Must be between 1 and 3. Default is None.
+    - S (float, optional): Sales for SME corporate exposures. Must be between 1 and 50. Default is None.
+
+    Returns:
+    - float: Risk-Weighted Assets (RWA) based on the given inputs.
+
+    Raises:
+    - AssertionError: If PD or LGD are not between 0 and 1.
+    """
+
+    # Validate input ranges
+    assert 0 <= PD <= 1, "PD must be between 0 and 1."
+    assert 0 <= LGD <= 1, "LGD must be between 0 and 1."
+    if M is not None:
+        M = np.clip(M, 1, 5)
+    if S is not None:
+        S = np.clip(S, 5, 50)
+
+    # The G function, the inverse of the standard normal cumulative distribution function
+    def G(z):
+        return norm.ppf(z)
+
+    # Calculate Correlation R based on exposure type
+    if exposure_type == "Residential Mortgages":
+        R = 0.15
+    elif exposure_type == "Qualifying Revolving Retail Exposures":
+        R = 0.04
+    elif exposure_type == "Other Retail Exposures":
+        R = 0.03 * (1 - np.exp(-35 * PD)) / (1 - np.exp(-35)) + 0.16 * (1 - (1 - np.exp(-35 * PD)) / (1 - np.exp(-35)))
+    elif exposure_type == "Corporate Exposures":
+        R = 0.12 * (1 - np.exp(-50 * PD)) / (1 - np.exp(-50)) + 0.24 * (1 - (1 - np.exp(-50 * PD)) / (1 - np.exp(-50)))
+        if S is not None:
+            R -= 0.04 * (1 - (S - 5) / 45)
+    else:
+        return np.nan
+
+    # Calculate Capital Requirement K
+    if exposure_type == "Corporate Exposures":
+        # Maturity adjustment b for corporate exposures
+        b = (0.11852 - 0.05478 * np.log(PD)) ** 2
+        K = (LGD * norm.cdf(np.sqrt((1 - R)**-1) * G(PD) + np.sqrt(R / (1 - R)) * G(0.999)) - PD * LGD) * (1 - 1.5 * b) ** -1 * (1 + (M - 2.5) * b)
+    else:
+        K = LGD * norm.cdf(((1 - R)**-0.5) * G(PD) + (R / (1 - R)) ** 0.5 * G(0.999)) - PD * LGD
+
+    # Calculate Risk-Weighted Assets RWA
+    RWA = K * 12.5 * EAD * add_on
+
+    return RWA
+
+
+def exposure_codes(exposure_type):
+    """
+    Position of each exposure class in EXPOSURE_CLASSES, -1 for unknown classes.
+    Integer arrays are taken to be codes already.
+    """
+    values = np.atleast_1d(np.asarray(exposure_type))
+    if np.issubdtype(values.dtype, np.integer):
+        return values
+    return pd.Categorical(values.ravel(), categories=EXPOSURE_CLASSES).codes.reshape(values.shape)
+
+
+def _pd_weight(PD, k):
+    return (1 - np.exp(-k * PD)) / (1 - np.exp(-k))
+
+
+def asset_correlation(codes, PD, S=None):
+    """
+    Asset correlation R of every exposure, NaN for unknown classes.
+
+    Sales S (in millions) lower the correlation of corporate exposures only; NaN sales
+    leave an exposure without the SME adjustment.
+    """
+    R = np.full(PD.shape, np.nan)
+    R[codes == MORTGAGE] = 0.15
+    R[codes == QRRE] = 0.04
+
+    mask = codes == OTHER_RETAIL
+    weight = _pd_weight(PD[mask], 35)
+    R[mask] = 0.03 * weight + 0.16 * (1 - weight)
+
+    mask = codes == CORPORATE
+    weight = _pd_weight(PD[mask], 50)
+    R[mask] = 0.12 * weight + 0.24 * (1 - weight)
+    if S is not None:
+        R[mask] -= np.nan_to_num(0.04 * (1 - (np.clip(S[mask], 5, 50) - 5) / 45))
+    return R
+
+
+def maturity_adjustment(codes, PD, M=None):
+    """
+    Maturity adjustment (1 + (M - 2.5) b) / (1 - 1.5 b) of corporate exposures, 1 for the
+    retail classes. M is clipped to [1, 5].
+    """
+    adjustment = np.ones(PD.shape)
+    mask = codes == CORPORATE
+    if not mask.any():
+        return adjustment
+    if M is None:
+        raise ValueError("Maturity (M) must be provided for Corporate Exposures.")
+    b = (0.11852 - 0.05478 * np.log(np.clip(PD[mask], PD_CLIP, 1 - PD_CLIP))) ** 2
+    adjustment[mask] = (1 + (np.clip(M[mask], 1, 5) - 2.5) * b) / (1 - 1.5 * b)
+    return adjustment
+
+
+def capital_requirement(PD, LGD, R, adjustment):
+    """Capital K per unit of exposure, floored at 0"""
+    PD_clipped = np.clip(PD, PD_CLIP, 1 - PD_CLIP)
+    K = LGD * ndtr((ndtri(PD_clipped) + np.sqrt(R) * G_999) / np.sqrt(1 - R)) - PD * LGD
+    return np.maximum(K * adjustment, 0)
+
+
+def _exposure_arrays(exposure_type, PD, LGD, EAD, add_on, M, S):
+    """Broadcast the exposure inputs against each other and check the PD and LGD ranges"""
+    arrays = [exposure_codes(exposure_type)] + [np.atleast_1d(np.asarray(x, dtype=float))
+                                                for x in (PD, LGD, EAD, add_on)]
+    if M is not None:
+        arrays.append(np.atleast_1d(np.asarray(M, dtype=float)))
+    if S is not None:
+        arrays.append(np.atleast_1d(np.asarray(S, dtype=float)))
+    codes, PD, LGD, EAD, add_on, *rest = np.broadcast_arrays(*arrays)
+    if M is not None:
+        M, *rest = rest
+    if S is not None:
+        S = rest[0]
+
+    for name, values in (("PD", PD), ("LGD", LGD)):
+        outside = np.count_nonzero((values < 0) | (values > 1))
+        if outside:
+            raise ValueError(f"{name} must be between 0 and 1, {outside} values are not.")
+    return codes, PD, LGD, EAD, add_on, M, S
+
+
+def calculate_RWA_batch(exposure_type, PD, LGD, EAD, add_on=1.06, M=None, S=None, dtype=np.float32):
+    """
+    Risk-Weighted Assets of arrays of exposures of any class.
+
+    Array version of `calculate_RWA`: exposure classes, PD, LGD, EAD, M and S are arrays
+    (or scalars) broadcast against each other, e.g. DataFrame columns. As in the
+    ranking_capital_requirements notebook, PDs are clipped to [1e-9, 1 - 1e-9] inside
+    the inverse normal and b(PD) and K is floored at 0, so PDs of 0 or 1 give finite RWA.
+
+    Parameters:
+    - exposure_type (array of str or int): Exposure class names of EXPOSURE_CLASSES, or their codes.
+    - PD (array): Probabilities of Default, between 0 and 1.
+    - LGD (array): Losses Given Default, between 0 and 1.
+    - EAD (array): Exposures at Default.
+    - add_on (float or array): Scaling factor applied to the RWA.
+    - M (array, optional): Maturities, required when there are corporate exposures. Clipped to [1, 5].
+    - S (array, optional): Sales of SME corporates, NaN for no SME adjustment. Clipped to [5, 50].
+    - dtype: Data type of the returned RWA. Intermediate terms are computed in float64.
+
+    Returns:
+    - array: RWA per exposure, NaN for unknown exposure classes.
+
+    Raises:
+    - ValueError: If any PD or LGD is outside [0, 1], or M is missing for corporate exposures.
+    """
+    codes, PD, LGD, EAD, add_on, M, S = _exposure_arrays(exposure_type, PD, LGD, EAD, add_on, M, S)
+    R = asset_correlation(codes, PD, S)
+    K = capital_requirement(PD, LGD, R, maturity_adjustment(codes, PD, M))
+    return (K * 12.5 * EAD * add_on).astype(dtype)
+
+
+# Correlation R = r_low * w + r_high * (1 - w) with w = (1 - exp(-k PD)) / (1 - exp(-k)), per class
+_CORRELATION_TERMS = {
+    CORPORATE: (50, 0.12, 0.24),
+    MORTGAGE: (35, 0.15, 0.15),
+    QRRE: (35, 0.04, 0.04),
+    OTHER_RETAIL: (35, 0.03, 0.16),
+}
+
+
+class RWAScenarios():
+    """
+    Portfolio RWA under grids of PD, LGD, maturity and add-on scenarios.
+
+    Everything that does not move with the shocks is computed once per exposure: the
+    class terms of the correlation, the SME adjustment, the raw maturities, the
+    EAD * 12.5 * add_on weight and the aggregation group. `table` then evaluates all
+    PD multipliers and maturity shifts as one broadcast (scenarios x exposures) array
+    per chunk of exposures. Since K is proportional to LGD, each (PD, maturity)
+    scenario gives a capital per unit of LGD, and a single sparse product then
+    aggregates it per group for every LGD multiplier. The add-on factors scale the
+    final table.
+
+    Parameters:
+    - exposure_type, PD, LGD, EAD, add_on, M, S: As in `calculate_RWA_batch`.
+    - groups (array, optional): Portfolio label of each exposure, e.g. the rating grade or exposure class.
+      Defaults to a single 'Portfolio' group.
+    - chunk_size (int): Number of exposures evaluated at once, which bounds the memory of a table
+      to about 8 * chunk_size * (PD multipliers x maturity shifts) bytes per array.
+
+    Raises:
+    - ValueError: If any PD or LGD is outside [0, 1], an exposure class is unknown, or M is
+      missing for corporate exposures.
+    """
+
+    def __init__(self, exposure_type, PD, LGD, EAD, add_on=1.06, M=None, S=None, groups=None, chunk_size=65536):
+        codes, PD, LGD, EAD, add_on, M, S = _exposure_arrays(exposure_type, PD, LGD, EAD, add_on, M, S)
+        codes, PD, LGD = codes.ravel(), PD.ravel(), LGD.ravel()
+        unknown = np.count_nonzero((codes < 0) | (codes >= len(EXPOSURE_CLASSES)))
+        if unknown:
+            raise ValueError(f"{unknown} exposures do not belong to any of {EXPOSURE_CLASSES}.")
+
+        self.PD = PD
+        self.LGD = LGD
+        self.weight = (12.5 * EAD * add_on).ravel()
+        self.EAD = EAD.ravel()
+
+        terms = np.array([_CORRELATION_TERMS[code] for code in range(len(EXPOSURE_CLASSES))])
+        self.k, self.r_low, self.r_high = terms[codes].T
+        self.k_scale = 1 / (1 - np.exp(-self.k))
+        self.sme = np.zeros(PD.shape)
+
+        self.corporate = codes == CORPORATE
+        if self.corporate.any():
+            if M is None:
+                raise ValueError("Maturity (M) must be provided for Corporate Exposures.")
+            # Kept unclipped, the maturity shifts of a scenario apply before the [1, 5] clip
+            self.M = M.ravel()
+            if S is not None:
+                mask = self.corporate
+                self.sme[mask] = np.nan_to_num(0.04 * (1 - (np.clip(S.ravel()[mask], 5, 50) - 5) / 45))
+        else:
+            self.M = np.full(PD.shape, 2.5)
+
+        if groups is None:
+            self.group_ids, self.group_names = np.zeros(PD.shape, dtype=np.intp), pd.Index(['Portfolio'])
+        else:
+            self.group_ids, self.group_names = pd.factorize(np.broadcast_to(np.asarray(groups, dtype=object), codes.shape), sort=True)
+        self.chunk_size = chunk_size
+
+    def _unit_capital(self, sl, pd_multipliers, maturity_shifts):
+        """Capital per unit of LGD, shape (PD multipliers, maturity shifts, exposures in sl)"""
+        PD = np.minimum(self.PD[sl] * pd_multipliers[:, None], 1)
+        PD_clipped = np.clip(PD, PD_CLIP, 1 - PD_CLIP)
+        weight = (1 - np.exp(-self.k[sl] * PD)) * self.k_scale[sl]
+        R = self.r_low[sl] * weight + self.r_high[sl] * (1 - weight) - self.sme[sl]
+        unexpected = ndtr((ndtri(PD_clipped) + np.sqrt(R) * G_999) / np.sqrt(1 - R)) - PD
+
+        adjustment = np.ones((len(pd_multipliers), len(maturity_shifts), PD.shape[1]))
+        corporate = self.corporate[sl]
+        if corporate.any():
+            b = (0.11852 - 0.05478 * np.log(PD_clipped[:, corporate])) ** 2
+            M = np.clip(self.M[sl][corporate] + maturity_shifts[:, None], 1, 5)
+            adjustment[:, :, corporate] = (1 + (M[None] - 2.5) * b[:, None]) / (1 - 1.5 * b[:, None])
+        return np.maximum(unexpected[:, None] * adjustment, 0)
+
+    def table(self, pd_multipliers=(1.0,), lgd_multipliers=(1.0,), maturity_shifts=(0.0,), add_on_factors=(1.0,),
+              risk_weight=False):
+        """
+        RWA per group for every combination of the scenario parameters.
+
+        Parameters:
+        - pd_multipliers (array): Factors applied to the PDs, capped at a PD of 1.
+        - lgd_multipliers (array): Factors applied to the LGDs, capped at an LGD of 1.
+        - maturity_shifts (array): Years added to the maturities before clipping them to [1, 5].
+        - add_on_factors (array): Factors applied on top of the exposures' add-on.
+        - risk_weight (bool): Return RWA / EAD per group instead of the RWA.
+
+        Returns:
+        - DataFrame: One row per scenario, indexed by (PD_multiplier, LGD_multiplier, M_shift, add_on_factor),
+          and one column per group.
+        """
+        pd_multipliers = np.asarray(pd_multipliers, dtype=float)
+        lgd_multipliers = np.asarray(lgd_multipliers, dtype=float)
+        maturity_shifts = np.asarray(maturity_shifts, dtype=float)
+        add_on_factors = np.asarray(add_on_factors, dtype=float)
+        n_groups = len(self.group_names)
+        n_lgd = len(lgd_multipliers)
+
+        rwa = np.zeros((len(pd_multipliers) * len(maturity_shifts), n_lgd * n_groups))
+        for start in range(0, len(self.PD), self.chunk_size):
+            sl = slice(start, start + self.chunk_size)
+            unit = self._unit_capital(sl, pd_multipliers, maturity_shifts)
+            unit = unit.reshape(-1, unit.shape[-1])
+
+            # Shocked LGD times weight of every exposure, placed in its (LGD multiplier, group) column
+            lgd = np.minimum(self.LGD[sl][:, None] * lgd_multipliers, 1) * self.weight[sl][:, None]
+            n = lgd.shape[0]
+            columns = np.arange(n_lgd) * n_groups + self.group_ids[sl][:, None]
+            loadings = sparse.csr_matrix((lgd.ravel(), (np.repeat(np.arange(n), n_lgd), columns.ravel())),
+                                         shape=(n, n_lgd * n_groups))
+            rwa += (loadings.T @ unit.T).T
+
+        # (PD, maturity, LGD, group) -> (PD, LGD, maturity, add-on, group)
+        rwa = rwa.reshape(len(pd_multipliers), len(maturity_shifts), n_lgd, n_groups).transpose(0, 2, 1, 3)
+        rwa = rwa[:, :, :, None, :] * add_on_factors[:, None]
+        if risk_weight:
+            rwa = rwa / np.bincount(self.group_ids, weights=self.EAD, minlength=n_groups)
+
+        index = pd.MultiIndex.from_product([pd_multipliers, lgd_multipliers, maturity_shifts, add_on_factors],
+                                           names=['PD_multiplier', 'LGD_multiplier', 'M_shift', 'add_on_factor'])
+        return pd.DataFrame(rwa.reshape(-1, n_groups), index=index, columns=self.group_names)
+
+
+if __name__ == "__main__":
+    # Data provided in the Annex 5 of https://www.bis.org/publ/bcbs128.pdf
+    data = [
+        [0.03, 14.44, 11.30, 4.15, 2.30, 4.45, 8.41, 0.98, 1.85],
+        [0.05, 19.65, 15.39, 6.23, 3.46, 6.63, 12.52, 1.51, 2.86],
+        [0.10, 29.65, 23.30, 10.69, 5.94, 11.16, 21.08, 2.71, 5.12],
+        [0.25, 49.47, 39.01, 21.30, 11.83, 21.15, 39.96, 5.76, 10.88],
+        [0.40, 62.72, 49.49, 29.94, 16.64, 28.42, 53.69, 8.41, 15.88],
+        [0.50, 69.61, 54.91, 35.08, 19.49, 32.36, 61.13, 10.04, 18.97],
+        [0.75, 82.78, 65.14, 46.46, 25.81, 40.10, 75.74, 13.80, 26.06],
+        [1.00, 92.32, 72.40, 56.40, 31.33, 45.77, 86.46, 17.22, 32.53],
+        [1.30, 100.95, 78.77, 67.00, 37.22, 50.80, 95.95, 21.02, 39.70],
+        [1.50, 105.59, 82.11, 73.45, 40.80, 53.37, 100.81, 23.40, 44.19],
+        [2.00, 114.86, 88.55, 87.94, 48.85, 57.99, 109.53, 28.92, 54.63],
+        [2.50, 122.16, 93.43, 100.64, 55.91, 60.90, 115.03, 33.98, 64.18],
+        [3.00, 128.44, 97.58, 111.99, 62.22, 62.79, 118.61, 38.66, 73.03],
+        [4.00, 139.58, 105.04, 131.63, 73.13, 65.01, 122.80, 47.16, 89.08],
+        [5.00, 149.86, 112.27, 148.22, 82.35, 66.42, 125.45, 54.75, 103.41],
+        [6.00, 159.61, 119.48, 162.52, 90.29, 67.73, 127.94, 61.61, 116.37],
+        [10.00, 193.09, 146.51, 204.41, 113.56, 75.54, 142.69, 83.89, 158.47],
+        [15.00, 221.54, 171.91, 235.72, 130.96, 88.60, 167.36, 103.89, 196.23],
+        [20.00, 238.23, 188.42, 253.12, 140.62, 100.28, 189.41, 117.99, 222.86]
+    ]
+    columns = [
+        ('Corporate Exposures', 0.45, 50),
+        ('Corporate Exposures', 0.45, 5),
+        ('Residential Mortgages', 0.45, 0),
+        ('Residential Mortgages', 0.25, 0),
+        ('Other Retail Exposures', 0.45, 0),
+        ('Other Retail Exposures', 0.85, 0),
+        ('Qualifying Revolving Retail Exposures', 0.45, 0),
+        ('Qualifying Revolving Retail Exposures', 0.85, 0),
+    ]
+    df = pd.DataFrame([(row[0], *column, value) for row in data for column, value in zip(columns, row[1:])],
+                      columns=['PD', 'Segment', 'LGD', 'SME', 'Value'])
+
+    df['RWA_calc'] = calculate_RWA_batch(df['Segment'], df['PD'] / 100, df['LGD'], 100, add_on=1.0, M=2.5, S=df['SME'])
+    df['diff'] = abs(1 - df['RWA_calc'].round(3) / df['Value'])
+    print(f"The maximum difference between calculated and provided RW is {df['diff'].max():.2%}")
+
+    # Risk weights of three books under PD and LGD stress
+    rng = np.random.default_rng(42)
+    n = 100_000
+    scenarios = RWAScenarios(rng.choice(EXPOSURE_CLASSES, n), rng.beta(0.5, 40, n), rng.uniform(0.1, 0.6, n),
+                             rng.lognormal(10, 1, n), M=rng.uniform(1, 5, n), S=rng.uniform(5, 60, n),
+                             groups=rng.choice(['A', 'B', 'C'], n))
+    print(scenarios.table(pd_multipliers=[1.0, 1.5, 2.0], lgd_multipliers=[1.0, 1.2], risk_weight=True))
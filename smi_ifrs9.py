@@ -0,0 +1,652 @@
+"""
+Supervised Macroeconomic Index (SMI) for IFRS9 forward-looking modelling.
+
+Functions packaged from the smi_ifrs9_python notebooks (a Python port of the R package `smi`),
+plus a batch estimator for large model spaces.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, product
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+
+class LagView:
+    """
+    Lagged columns served as views of one padded copy per variable.
+
+    `view['GDP_lag2']` returns a read-only view (no copy) and `view[['GDP_lag1', 'UNEMP']]`
+    stacks the requested columns into one array, so model estimation can read the lags it
+    needs without materialising all of them. Build it with `lv(db, x, n, lazy=True)`.
+    """
+
+    def __init__(self, db, x, n):
+        self.index = db.index
+        self._n_rows = len(db)
+        self._padded = {}
+        self._lags = {}
+        for var in x:
+            max_lag = n[var]
+            values = db[var].to_numpy(dtype=float)
+            self._padded[var] = np.concatenate([np.full(max_lag, np.nan), values])
+            for lag in range(1, max_lag + 1):
+                self._lags[f"{var}_lag{lag}"] = (var, lag)
+        self.columns = list(self._lags)
+
+    def __contains__(self, name):
+        return name in self._lags
+
+    def __getitem__(self, name):
+        if not isinstance(name, str):
+            return np.column_stack([self[col] for col in name])
+        var, lag = self._lags[name]
+        start = len(self._padded[var]) - self._n_rows - lag
+        column = self._padded[var][start:start + self._n_rows]
+        column.flags.writeable = False
+        return column
+
+    def to_frame(self):
+        """Materialise all lagged columns, as returned by `lv`"""
+        return pd.DataFrame(self[self.columns], index=self.index, columns=self.columns)
+
+
+def lv(db, x, n, lazy=False):
+    """
+    Create lagged variables for specified columns.
+
+    All lags are written into one preallocated array, each variable's block
+    filled from a sliding-window view of its NaN-padded values.
+
+    Parameters:
+    -----------
+    db : DataFrame
+        Input dataframe
+    x : list
+        List of column names to lag
+    n : dict
+        Dictionary with variable names as keys and number of lags as values
+    lazy : bool
+        Return a LagView that serves the lagged columns on demand instead
+
+    Returns:
+    --------
+    DataFrame with lagged variables (or LagView if lazy)
+    """
+    if lazy:
+        return LagView(db, x, n)
+
+    columns = [f"{var}_lag{lag}" for var in x for lag in range(1, n[var] + 1)]
+    # One row per lagged column, so each block is a contiguous copy and the transpose becomes a single pandas block
+    result = np.empty((len(columns), len(db)))
+    start = 0
+    for var in x:
+        max_lag = n[var]
+        if max_lag == 0:
+            continue
+        padded = np.concatenate([np.full(max_lag, np.nan), db[var].to_numpy(dtype=float)])
+        # windows[k] = padded[k:k + rows] is the series lagged by max_lag - k
+        windows = np.lib.stride_tricks.sliding_window_view(padded, len(db))
+        result[start:start + max_lag] = windows[max_lag - 1::-1]
+        start += max_lag
+    return pd.DataFrame(result.T, index=db.index, columns=columns)
+
+
+def pg(n):
+    """
+    Create predictor groups.
+
+    Parameters:
+    -----------
+    n : dict
+        Dictionary with variable names and number of lags
+
+    Returns:
+    --------
+    Dictionary with predictor groups
+    """
+    groups = {}
+    for var, max_lag in n.items():
+        group = [var]  # Include the original variable (no lag)
+        for lag in range(1, max_lag + 1):
+            group.append(f"{var}_lag{lag}")
+        groups[var] = group
+    return groups
+
+
+def pg_c(groups, max_pred=3):
+    """
+    Create all valid predictor combinations.
+
+    Only one predictor from each group can be included in a combination.
+    For large model spaces, combinations_model.CombinationSpace enumerates the
+    same combinations lazily and can shard them across workers.
+
+    Parameters:
+    -----------
+    groups : dict
+        Dictionary of predictor groups
+    max_pred : int
+        Maximum number of predictors per model
+
+    Returns:
+    --------
+    List of tuples representing valid predictor combinations
+    """
+    group_names = list(groups.keys())
+    all_combinations = []
+
+    # Generate combinations for 1 to max_pred predictors
+    for num_pred in range(1, max_pred + 1):
+        # Select which groups to include
+        for selected_groups in combinations(group_names, num_pred):
+            # Get all members of selected groups
+            group_members = [groups[g] for g in selected_groups]
+            # Create all combinations (one from each selected group)
+            for combo in product(*group_members):
+                all_combinations.append(combo)
+
+    return all_combinations
+
+
+def get_expected_sign(predictor_name, ps):
+    """
+    Get the expected sign for a predictor (including lagged versions).
+    """
+    # Extract base variable name (remove _lagN suffix if present)
+    base_name = predictor_name.split('_lag')[0]
+    return ps.get(base_name, None)
+
+
+def _sign_bounds(predictor_names, ps):
+    # First bound is for intercept (unbounded)
+    bounds = [(None, None)]
+    for pred_name in predictor_names:
+        sign = get_expected_sign(pred_name, ps)
+        if sign == '+':
+            bounds.append((0, None))  # Non-negative
+        elif sign == '-':
+            bounds.append((None, 0))  # Non-positive
+        else:
+            bounds.append((None, None))  # Unbounded
+    return bounds
+
+
+def constrained_ols(y, X, expected_signs, predictor_names):
+    """
+    Perform constrained OLS regression.
+
+    Parameters:
+    -----------
+    y : array-like
+        Target variable
+    X : array-like
+        Design matrix (including intercept)
+    expected_signs : dict
+        Expected signs for base predictors
+    predictor_names : list
+        Names of predictors (excluding intercept)
+
+    Returns:
+    --------
+    Estimated coefficients
+    """
+    n_params = X.shape[1]
+
+    # Objective function: sum of squared residuals
+    def objective(beta):
+        residuals = y - X @ beta
+        return 0.5 * np.sum(residuals ** 2)
+
+    # Gradient
+    def gradient(beta):
+        residuals = y - X @ beta
+        return -X.T @ residuals
+
+    # Set bounds based on expected signs
+    bounds = _sign_bounds(predictor_names, expected_signs)
+
+    # Initial values (OLS solution)
+    try:
+        beta_init = np.linalg.lstsq(X, y, rcond=None)[0]
+    except np.linalg.LinAlgError:
+        beta_init = np.zeros(n_params)
+
+    # Optimize
+    result = minimize(
+        objective,
+        beta_init,
+        method='L-BFGS-B',
+        jac=gradient,
+        bounds=bounds,
+        options={'ftol': 1e-15, 'gtol': 1e-12, 'maxiter': 10000}
+    )
+
+    return result.x
+
+
+def _split_lag(pred_name):
+    # Parse lag
+    if '_lag' in pred_name:
+        base_pred, lag = pred_name.split('_lag')
+        return base_pred, int(lag)
+    return pred_name, 0
+
+
+def _fit_statistics(ssr, sst, n, k):
+    # R-squared, AIC and BIC of a Gaussian linear model from its sums of squares
+    r_squared = 1 - ssr / sst if sst > 0 else 0
+    mse = ssr / n
+    if mse > 0:
+        log_lik = -n / 2 * (np.log(2 * np.pi) + np.log(mse) + 1)
+        return r_squared, 2 * k - 2 * log_lik, k * np.log(n) - 2 * log_lik
+    return r_squared, np.nan, np.nan
+
+
+def _model_rows(model_id, pred_list, coefficients, r_squared, aic, bic, has_zero_coef):
+    # Store intercept result
+    rows = [{
+        'model.id': model_id,
+        'coefficient': '(Intercept)',
+        'estimate': coefficients[0],
+        'r.squared': r_squared if coefficients[0] == coefficients[0] else np.nan,
+        'aic': aic,
+        'bic': bic,
+        'zero.coeff': has_zero_coef,
+        'predictor': '(Intercept)',
+        'lag': 0
+    }]
+
+    # Store predictor results
+    for i, pred_name in enumerate(pred_list):
+        base_pred, lag = _split_lag(pred_name)
+        rows.append({
+            'model.id': model_id,
+            'coefficient': pred_name,
+            'estimate': coefficients[i + 1],
+            'r.squared': r_squared if i == 0 else np.nan,
+            'aic': aic if i == 0 else np.nan,
+            'bic': bic if i == 0 else np.nan,
+            'zero.coeff': has_zero_coef,
+            'predictor': base_pred,
+            'lag': lag
+        })
+    return rows
+
+
+def model_est(gr_c, ps, db, target, weights=None):
+    """
+    Estimate all model combinations using constrained OLS.
+
+    Parameters:
+    -----------
+    gr_c : list
+        List of predictor combinations
+    ps : dict
+        Expected signs dictionary
+    db : DataFrame
+        Data (realized observations only)
+    target : str
+        Name of target column
+    weights : array-like, optional
+        Observation weights (currently not used in the estimation)
+
+    Returns:
+    --------
+    Dictionary with 'models' and 'pred' DataFrames
+    """
+    results = []
+    predictions = []
+
+    for model_idx, predictors in enumerate(gr_c, 1):
+        model_id = f"Model_{model_idx}"
+        pred_list = list(predictors)
+
+        # Get complete cases for this model
+        cols_needed = [target] + pred_list
+        data_subset = db[cols_needed].dropna()
+
+        if len(data_subset) < 10:  # Need sufficient observations
+            continue
+
+        y = data_subset[target].values
+        X = data_subset[pred_list].values
+
+        # Add intercept
+        X_with_intercept = np.column_stack([np.ones(len(y)), X])
+
+        # Estimate constrained OLS
+        try:
+            coefficients = constrained_ols(y, X_with_intercept, ps, pred_list)
+        except Exception:
+            continue
+
+        # Calculate R-squared, AIC and BIC
+        y_pred = X_with_intercept @ coefficients
+        ss_res = np.sum((y - y_pred) ** 2)
+        ss_tot = np.sum((y - np.mean(y)) ** 2)
+        r_squared, aic, bic = _fit_statistics(ss_res, ss_tot, len(y), len(coefficients))
+
+        # Check for zero coefficients (constraint binding)
+        # Small threshold to account for numerical precision
+        zero_threshold = 1e-10
+        has_zero_coef = any(abs(c) < zero_threshold for c in coefficients[1:])  # Exclude intercept
+
+        results.extend(_model_rows(model_id, pred_list, coefficients, r_squared, aic, bic, has_zero_coef))
+
+        # Store predictions (aligned with full realized dataset)
+        full_pred = np.full(len(db), np.nan)
+        valid_idx = data_subset.index
+        full_pred[valid_idx] = y_pred
+        predictions.append(full_pred)
+
+    return {
+        'models': pd.DataFrame(results),
+        'pred': predictions
+    }
+
+
+def _constrained_gram(task):
+    """Constrained OLS from the Gram sub-block: minimise 0.5 * (y'y - 2 b'X'y + b'X'X b)"""
+    A, c, yty, bounds, beta_init = task
+
+    def objective(beta):
+        return 0.5 * (yty - 2 * beta @ c + beta @ A @ beta)
+
+    def gradient(beta):
+        return A @ beta - c
+
+    result = minimize(
+        objective,
+        beta_init,
+        method='L-BFGS-B',
+        jac=gradient,
+        bounds=bounds,
+        options={'ftol': 1e-15, 'gtol': 1e-12, 'maxiter': 10000}
+    )
+    return result.x
+
+
+def model_est_batch(gr_c, ps, db, target, weights=None, n_jobs=1, lags=None):
+    """
+    Estimate all model combinations using constrained OLS, in batches.
+
+    Gives the same output as `model_est`, but builds the Gram matrix of
+    [intercept, target, all candidate predictors] once per complete-case pattern
+    (models differ only in which leading rows their lags remove) and solves each
+    model from its sub-block, batching models of the same size. When the
+    unconstrained solution already has the expected signs it is also the
+    constrained solution; only the remaining models go through the L-BFGS-B
+    optimiser, in a process pool when n_jobs > 1.
+
+    Parameters:
+    -----------
+    gr_c : iterable
+        Predictor combinations, e.g. from pg_c or combinations_model.CombinationSpace
+    ps : dict
+        Expected signs dictionary
+    db : DataFrame
+        Data (realized observations only)
+    target : str
+        Name of target column
+    weights : array-like, optional
+        Observation weights (currently not used in the estimation, as in model_est)
+    n_jobs : int
+        Number of worker processes for the constrained fits (-1 for all cores)
+    lags : LagView, optional
+        Lagged columns from lv(..., lazy=True), read for predictors not in db
+
+    Returns:
+    --------
+    Dictionary with 'models' and 'pred' DataFrames
+    """
+    gr_c = [list(predictors) for predictors in gr_c]
+    candidates = list(dict.fromkeys(name for predictors in gr_c for name in predictors))
+    position = {name: i + 2 for i, name in enumerate(candidates)}
+
+    # Columns: intercept, target, candidates
+    Z = np.empty((len(db), len(candidates) + 2))
+    Z[:, 0] = 1.0
+    for j, name in enumerate([target] + candidates, 1):
+        Z[:, j] = lags[name] if lags is not None and name not in db.columns else db[name]
+    valid = ~np.isnan(Z)
+    Z = np.where(valid, Z, 0.0)
+
+    # Group the models by complete-case rows and number of parameters
+    batches = {}
+    for model_idx, pred_list in enumerate(gr_c, 1):
+        cols = [0] + [position[name] for name in pred_list]
+        rows = valid[:, 1] & valid[:, cols].all(axis=1)
+        key = (np.packbits(rows).tobytes(), len(cols))
+        batches.setdefault(key, (rows, []))[1].append((model_idx, cols))
+
+    fitted = {}
+    pending = []
+    for rows, models in batches.values():
+        n = rows.sum()
+        if n < 10:  # Need sufficient observations
+            continue
+        Zr = Z[rows]
+        G = Zr.T @ Zr
+        yty = G[1, 1]
+        sst = yty - G[0, 1] ** 2 / n
+
+        idx = np.array([cols for _, cols in models])
+        A = G[idx[:, :, None], idx[:, None, :]]
+        c = G[idx, 1]
+        try:
+            beta = np.linalg.solve(A, c[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            beta = np.array([np.linalg.lstsq(A_i, c_i, rcond=None)[0] for A_i, c_i in zip(A, c)])
+
+        for i, (model_idx, cols) in enumerate(models):
+            pred_list = gr_c[model_idx - 1]
+            bounds = _sign_bounds(pred_list, ps)
+            feasible = all((lo is None or b >= lo) and (hi is None or b <= hi)
+                           for b, (lo, hi) in zip(beta[i], bounds))
+            fitted[model_idx] = [beta[i], A[i], c[i], yty, sst, n, rows]
+            if not feasible:
+                pending.append((model_idx, (A[i], c[i], yty, bounds, beta[i])))
+
+    # Optimise the models whose OLS solution violates the expected signs
+    if pending:
+        tasks = [task for _, task in pending]
+        if n_jobs == 1:
+            solutions = list(map(_constrained_gram, tasks))
+        else:
+            max_workers = None if n_jobs == -1 else n_jobs
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                solutions = list(pool.map(_constrained_gram, tasks, chunksize=max(1, len(tasks) // 64)))
+        for (model_idx, _), solution in zip(pending, solutions):
+            fitted[model_idx][0] = solution
+
+    results = []
+    predictions = []
+    zero_threshold = 1e-10
+    for model_idx in sorted(fitted):
+        coefficients, A, c, yty, sst, n, rows = fitted[model_idx]
+        pred_list = gr_c[model_idx - 1]
+
+        ss_res = yty - 2 * coefficients @ c + coefficients @ A @ coefficients
+        r_squared, aic, bic = _fit_statistics(ss_res, sst, n, len(coefficients))
+        has_zero_coef = bool((np.abs(coefficients[1:]) < zero_threshold).any())
+        results.extend(_model_rows(f"Model_{model_idx}", pred_list, coefficients, r_squared, aic, bic, has_zero_coef))
+
+        full_pred = np.full(len(db), np.nan)
+        full_pred[rows] = Z[rows][:, [0] + [position[name] for name in pred_list]] @ coefficients
+        predictions.append(full_pred)
+
+    return {
+        'models': pd.DataFrame(results),
+        'pred': predictions
+    }
+
+
+SMI_WEIGHTS = ('average', 'aic', 'r.squared')
+
+
+class SMIAccumulator:
+    """
+    Running model average of SMI coefficients.
+
+    Each coefficient is averaged over the models that contain it, with a weight per model:
+    'average' (equal weights), 'aic' (Akaike weights exp(-0.5 * (AIC - min AIC)), the
+    minimum taken over the models containing the coefficient) or 'r.squared'. Only
+    weighted sums per coefficient are kept, so models can be added in chunks as they
+    are estimated and memory does not grow with the model count.
+
+    Parameters:
+    -----------
+    weights : str
+        Weighting scheme, one of SMI_WEIGHTS
+    drop_zero_coeff : bool
+        Skip models flagged with zero coefficients (constraint binding) when they are added
+    """
+
+    def __init__(self, weights='average', drop_zero_coeff=False):
+        if weights not in SMI_WEIGHTS:
+            raise ValueError(f"Weighting scheme '{weights}' is not supported, use one of {SMI_WEIGHTS}")
+        self.weights = weights
+        self.drop_zero_coeff = drop_zero_coeff
+        self.n_models = 0
+        self._index = {}
+        self._weighted_sum = np.zeros(0)
+        self._weight_sum = np.zeros(0)
+        self._aic_ref = np.zeros(0)
+
+    def add(self, models):
+        """Add a chunk of model results in the layout of model_est()['models']"""
+        if self.drop_zero_coeff:
+            models = models[~models['zero.coeff'].astype(bool)]
+        if models.empty:
+            return self
+
+        codes, names = pd.factorize(models['coefficient'])
+        for name in names:
+            if name not in self._index:
+                self._index[name] = len(self._index)
+        grow = len(self._index) - len(self._weight_sum)
+        if grow:
+            self._weighted_sum = np.concatenate([self._weighted_sum, np.zeros(grow)])
+            self._weight_sum = np.concatenate([self._weight_sum, np.zeros(grow)])
+            self._aic_ref = np.concatenate([self._aic_ref, np.full(grow, np.inf)])
+
+        position = np.array([self._index[name] for name in names])[codes]
+
+        # Model-level weight, stored on the intercept row of each model
+        if self.weights == 'average':
+            w = np.ones(len(models))
+        else:
+            w = models.groupby('model.id', sort=False)[self.weights].transform('first').to_numpy(dtype=float, copy=True)
+            w[~np.isfinite(w)] = np.nan
+            if self.weights == 'aic':
+                # Keep each coefficient's weights relative to the lowest AIC among its models,
+                # rescaling its sums when that drops; the reference cancels in the average, and
+                # its best model has weight 1, so a wide AIC spread cannot underflow all of them
+                aic_ref = self._aic_ref.copy()
+                np.fmin.at(aic_ref, position, w)
+                seen = np.isfinite(self._aic_ref)
+                scale = np.exp(-0.5 * (self._aic_ref[seen] - aic_ref[seen]))
+                self._weighted_sum[seen] *= scale
+                self._weight_sum[seen] *= scale
+                self._aic_ref = aic_ref
+                w = np.exp(-0.5 * (w - aic_ref[position]))
+            w = np.nan_to_num(w, nan=0.0)
+
+        np.add.at(self._weighted_sum, position, w * models['estimate'].to_numpy(dtype=float))
+        np.add.at(self._weight_sum, position, w)
+        self.n_models += models['model.id'].nunique()
+        return self
+
+    def coef(self):
+        """Averaged coefficients, sorted by name"""
+        names = np.array(list(self._index), dtype=object)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            estimate = self._weighted_sum / self._weight_sum
+        coef = pd.DataFrame({'coefficient': names, 'estimate': estimate})
+        return coef.sort_values('coefficient').reset_index(drop=True)
+
+    def result(self, db):
+        """Dictionary with 'smi' values for `db` (or a dict of scenario frames) and the 'coef' DataFrame"""
+        coef = self.coef()
+        return {
+            'smi': smi_values(coef, db),
+            'coef': coef
+        }
+
+
+def smi_values(coef, db):
+    """
+    Compute the SMI as intercept + X @ beta.
+
+    Coefficients without a matching column in `db` are ignored and the SMI is NaN
+    where any of the used predictors is missing. `db` can also be a dict of scenario
+    frames, which are stacked into one predictor matrix and scored with a single product.
+    """
+    if isinstance(db, dict):
+        frames = list(db.values())
+        values = smi_values(coef, pd.concat(frames, ignore_index=True))
+        bounds = np.cumsum([0] + [len(frame) for frame in frames])
+        return {name: values[bounds[i]:bounds[i + 1]] for i, name in enumerate(db)}
+
+    names = coef['coefficient'].to_numpy()
+    estimate = coef['estimate'].to_numpy(dtype=float)
+    intercept = estimate[names == '(Intercept)'].sum()
+    used = np.array([name != '(Intercept)' and name in db.columns for name in names], dtype=bool)
+
+    X = db[list(names[used])].to_numpy(dtype=float)
+    has_missing = np.isnan(X).any(axis=1)
+    values = intercept + np.nan_to_num(X, nan=0.0) @ estimate[used]
+
+    # Set SMI to NaN where any predictor was missing
+    values[has_missing] = np.nan
+    return values
+
+
+def smi(models, db, weights='average'):
+    """
+    Construct the Supervised Macroeconomic Index through model averaging.
+
+    Parameters:
+    -----------
+    models : DataFrame
+        Filtered model results (no zero coefficients)
+    db : DataFrame or dict
+        Full dataset (including forecasts), or a dict of scenario datasets
+    weights : str
+        Weighting scheme: 'average' for simple averaging, 'aic' for Akaike weights
+        or 'r.squared' for R-squared weights
+
+    Returns:
+    --------
+    Dictionary with 'smi' values and 'coef' DataFrame
+    """
+    return SMIAccumulator(weights).add(models).result(db)
+
+
+if __name__ == "__main__":
+    # Simulated quarterly data with the structure of the package example (58 realized quarters)
+    rng = np.random.default_rng(0)
+    n_obs = 58
+    db = pd.DataFrame({
+        'UNEMP': 10 + np.cumsum(rng.normal(0, 0.3, n_obs)),
+        'GDP': rng.normal(2, 1.5, n_obs),
+        'WAGE': rng.normal(3, 1, n_obs),
+        'EURIBOR': 1 + np.cumsum(rng.normal(0, 0.1, n_obs)),
+    })
+    db['ODR'] = 0.02 + 0.004 * db['UNEMP'] - 0.003 * db['GDP'].shift(1).fillna(2) + rng.normal(0, 0.002, n_obs)
+
+    pn = ["UNEMP", "GDP", "WAGE", "EURIBOR"]
+    ps = {"UNEMP": "+", "GDP": "-", "WAGE": "-", "EURIBOR": "+"}
+    pl = {"UNEMP": 4, "GDP": 4, "WAGE": 4, "EURIBOR": 4}
+
+    db = pd.concat([db, lv(db, pn, pl)], axis=1)
+    gr_c = pg_c(pg(pl), max_pred=3)
+
+    res = model_est_batch(gr_c, ps, db, target='ODR')['models']
+    print(f"Estimated {res['model.id'].nunique()} of {len(gr_c)} models")
+    print(res.head(10))
+
+    # Average the models without binding constraints
+    smi_r = smi(res[~res['zero.coeff']], db, weights='average')
+    print(smi_r['coef'])